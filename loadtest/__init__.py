@@ -0,0 +1,4 @@
+"""
+Load testing support for the Person API: reproducible data, key popularity models
+and SLO checks. The scenarios themselves are in locust.py, at the repo root.
+"""
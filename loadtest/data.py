@@ -0,0 +1,114 @@
+#!/usr/bin/env python
+"""
+Reproducible test data: the same size and seed always give the same people, so
+locust processes can pick keys from the dataset without querying the database.
+"""
+
+import bisect
+import random
+from datetime import date, timedelta
+from typing import List, Optional
+
+# fmt: off
+first_names = ["Ana", "Bruno", "Carla", "Diego", "Elisa", "Fabio", "Gabriela",
+               "Heitor", "Isabel", "João", "Karina", "Lucas", "Marina", "Nuno",
+               "Olga", "Paulo", "Quitéria", "Rafael", "Sofia", "Tiago"]
+last_names = ["Almeida", "Barbosa", "Cardoso", "Dias", "Esteves", "Ferreira",
+              "Gomes", "Lima", "Moraes", "Nunes", "Oliveira", "Pereira", "Rocha",
+              "Santos", "Teixeira", "Vieira"]
+# fmt: on
+
+# seeded people get base numbers below this, people created during the tests above
+_fresh_cpf_start = 500_000_000
+_cpf_base_limit = 1_000_000_000
+
+
+def cpf_check_digit(digits: List[int]) -> int:
+    total = sum(d * w for d, w in zip(digits, range(len(digits) + 1, 1, -1)))
+    remainder = total * 10 % 11
+    return 0 if remainder == 10 else remainder
+
+
+def cpf_from_number(base: int) -> Optional[str]:
+    """Returns the valid, formatted CPF with the given 9 digit base number.
+
+    Returns None for bases with all digits equal, which make no valid CPF.
+    """
+    digits = [int(d) for d in "%09d" % base]
+    if len(set(digits)) == 1:
+        return None
+    digits.append(cpf_check_digit(digits))
+    digits.append(cpf_check_digit(digits))
+    s = "".join(str(d) for d in digits)
+    return "%s.%s.%s-%s" % (s[:3], s[3:6], s[6:9], s[9:])
+
+
+def random_cpf(rng: random.Random, start: int = 1, stop: int = _cpf_base_limit):
+    "Returns a random valid CPF, with base number in range(start, stop)."
+    while True:
+        cpf = cpf_from_number(rng.randrange(start, stop))
+        if cpf:
+            return cpf
+
+
+def fresh_cpf(rng: random.Random) -> str:
+    "Returns a random valid CPF that is never part of a generated dataset."
+    return random_cpf(rng, _fresh_cpf_start)
+
+
+def random_person(rng: random.Random, cpf: str) -> dict:
+    first_name = rng.choice(first_names)
+    last_name = rng.choice(last_names)
+    birth_date = date(1930, 1, 1) + timedelta(days=rng.randrange(75 * 365))
+    return {
+        "firstName": first_name,
+        "lastName": last_name,
+        "cpf": cpf,
+        "email": "%s.%s.%s@example.com"
+        % (first_name.lower(), last_name.lower(), cpf[:3] + cpf[4:7] + cpf[8:11]),
+        "birthDate": birth_date.strftime("%Y-%m-%d"),
+    }
+
+
+class Dataset:
+    """The people seeded for a load test.
+
+    The first `admins` people are the ones seeded as admins, so they can log in.
+    """
+
+    def __init__(self, size: int, seed: int, admins: int = 1):
+        rng = random.Random(seed)
+        cpfs: List[str] = []
+        seen = set()
+        while len(cpfs) < size:
+            cpf = random_cpf(rng, 1, _fresh_cpf_start)
+            if cpf not in seen:
+                seen.add(cpf)
+                cpfs.append(cpf)
+        self.people = [random_person(rng, cpf) for cpf in cpfs]
+        self.admins = min(admins, size)
+        # the ones scenarios may read and change freely
+        self.regular_people = self.people[self.admins :]
+
+    @property
+    def admin_cpfs(self) -> List[str]:
+        return [p["cpf"] for p in self.people[: self.admins]]
+
+
+class ZipfSampler:
+    """Picks indexes in range(n), the k-th most popular with weight 1/k^exponent.
+
+    Index 0 is the most popular. With exponent 0 all indexes are equally likely.
+    """
+
+    def __init__(self, n: int, exponent: float, rng: random.Random):
+        self.rng = rng
+        self.cumulative_weights = []
+        total = 0.0
+        for rank in range(1, n + 1):
+            total += 1 / rank**exponent
+            self.cumulative_weights.append(total)
+
+    def sample(self) -> int:
+        point = self.rng.random() * self.cumulative_weights[-1]
+        return bisect.bisect_right(self.cumulative_weights, point)
@@ -0,0 +1,79 @@
+#!/usr/bin/env python
+"""
+Seeds MongoDB with a load test dataset. Safe to run again: people are upserted.
+
+    python -m loadtest.seed --size 10000 --seed 42
+
+The same size, seed and admins must then be given to locust. On a partitioned
+deployment, people are spread over the partitions as the API expects them.
+Password hashing is configured from the same PERSONAPI_* variables as the API, so
+the first logins don't measure rehashing instead of the usual ones.
+"""
+
+import argparse
+
+from personapi.auth import PasswordHasher
+from personapi.partitioning import partition_index
+from personapi.store import User
+from personapi.utils import Settings
+from pymongo import MongoClient, ReplaceOne
+
+from .data import Dataset
+
+default_admin_password = "LoadTest$ecret1"  # nosec: only for test databases
+
+
+def main(argv=None):
+    # the token secret is required by the settings, but not needed here
+    settings = Settings(auth_token_base_secret="unused")
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument(
+        "--db-conn-str",
+        action="append",
+        default=None,
+        help="repeat for each partition, in the order the API uses (default: "
+        "PERSONAPI_DB_PARTITIONS, or else PERSONAPI_DB_CONN_STR)",
+    )
+    parser.add_argument("--size", type=int, default=1000)
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--admins", type=int, default=1)
+    parser.add_argument("--admin-password", default=default_admin_password)
+    parser.add_argument("--batch-size", type=int, default=1000)
+    parser.add_argument(
+        "--drop", action="store_true", help="drop all users before seeding"
+    )
+    args = parser.parse_args(argv)
+
+    dataset = Dataset(args.size, args.seed, args.admins)
+    # one hash is enough, they all share the password
+    hasher = PasswordHasher.from_settings(settings)
+    hashed_password = hasher.get_hash(args.admin_password)
+    conn_strings = args.db_conn_str or settings.db_partitions or [settings.db_conn_str]
+    partitions = [MongoClient(c)["people"].users for c in conn_strings]
+    for users in partitions:
+        if args.drop:
+            users.drop()
+        # as the API does, so upserts by cpf don't scan the collection
+        users.create_index("cpf", unique=True)
+
+    # each person goes to the partition the API will look for them in
+    operations = [[] for _ in partitions]
+    for i, person in enumerate(dataset.people):
+        # validate and convert it as the API would have
+        doc = dict(User(**person).dict(), isAdmin=i < dataset.admins)
+        if doc["isAdmin"]:
+            doc["hashedPassword"] = hashed_password
+        index = partition_index(doc["cpf"], len(partitions))
+        operations[index].append(ReplaceOne({"cpf": doc["cpf"]}, doc, upsert=True))
+    for users, partition_operations in zip(partitions, operations):
+        for start in range(0, len(partition_operations), args.batch_size):
+            batch = partition_operations[start : start + args.batch_size]
+            users.bulk_write(batch, ordered=False)
+    print(
+        "Seeded %d people (%d admins) with seed %d"
+        % (len(dataset.people), dataset.admins, args.seed)
+    )
+
+
+if __name__ == "__main__":  # pragma: no cover
+    main()
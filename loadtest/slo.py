@@ -0,0 +1,78 @@
+#!/usr/bin/env python
+"""
+Service level objectives for load tests, and checking run results against them.
+"""
+
+import json
+from typing import Dict, List, Optional
+
+from pydantic import BaseModel
+
+
+class SLO(BaseModel):
+    "Objectives for a load test run. Unset ones are not checked."
+
+    min_rps: Optional[float] = None
+    max_p95_ms: Optional[float] = None
+    max_p99_ms: Optional[float] = None
+    max_error_rate: Optional[float] = None
+
+
+class Metrics(BaseModel):
+    "Aggregated results of a load test run."
+
+    requests: int
+    failures: int
+    rps: float
+    p95_ms: float
+    p99_ms: float
+
+    @property
+    def error_rate(self) -> float:
+        return self.failures / self.requests if self.requests else 0.0
+
+
+def load_slos(path: str) -> Dict[str, SLO]:
+    "Reads SLOs from a JSON file, with one object of objectives per profile name."
+    with open(path) as f:
+        return {name: SLO(**slo) for name, slo in json.load(f).items()}
+
+
+def check_slo(metrics: Metrics, slo: SLO) -> List[str]:
+    "Returns a description of each objective not met. Empty if all were met."
+    violations = []
+    if metrics.requests == 0:
+        violations.append("no requests were made")
+    if slo.min_rps is not None and metrics.rps < slo.min_rps:
+        violations.append("throughput %.1f rps < %.1f" % (metrics.rps, slo.min_rps))
+    if slo.max_p95_ms is not None and metrics.p95_ms > slo.max_p95_ms:
+        violations.append("p95 %.0f ms > %.0f" % (metrics.p95_ms, slo.max_p95_ms))
+    if slo.max_p99_ms is not None and metrics.p99_ms > slo.max_p99_ms:
+        violations.append("p99 %.0f ms > %.0f" % (metrics.p99_ms, slo.max_p99_ms))
+    if slo.max_error_rate is not None and metrics.error_rate > slo.max_error_rate:
+        violations.append(
+            "error rate %.2f%% > %.2f%%"
+            % (metrics.error_rate * 100, slo.max_error_rate * 100)
+        )
+    return violations
+
+
+def build_report(profile: str, metrics: Metrics, slo: SLO) -> dict:
+    "Returns the machine readable result of a run, ready to be dumped as JSON."
+    violations = check_slo(metrics, slo)
+    return {
+        "profile": profile,
+        "passed": not violations,
+        "violations": violations,
+        "metrics": dict(metrics.dict(), error_rate=metrics.error_rate),
+        "slo": slo.dict(),
+    }
+
+
+def exit_code(report: dict) -> int:
+    """Returns the status a load test run should exit with, given its report.
+
+    Meant to be always set on locust: otherwise it exits with 1 on any failed
+    request, even when the error rate is within the objectives.
+    """
+    return 0 if report["passed"] else 1
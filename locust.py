@@ -1,14 +1,270 @@
 #!/usr/bin/env python
+"""
+Load test scenarios for the Person API.
 
-from locust import HttpUser, task
+Seed the database first (python -m loadtest.seed), with the same dataset size, seed
+and admins given here. Then pick a scenario by its user class, for example:
 
+    locust -f locust.py --headless -u 50 -r 10 -t 2m -H http://localhost:8000 \
+        --report report.json ReadHeavyUser
 
-class ApiUser(HttpUser):
-    @task
-    def get_users(self):
+At the end, results are checked against the SLO profile of the scenario (see
+loadtest/slos.json), and locust exits with status 1 if any objective was missed.
+"""
+
+import json
+import random
+import time
+
+from locust import HttpUser, between, events, task
+from locust.runners import WorkerRunner
+
+from loadtest.data import Dataset, ZipfSampler, fresh_cpf, random_person
+from loadtest.seed import default_admin_password
+from loadtest.slo import Metrics, build_report, exit_code, load_slos
+
+dataset = None  # built on init, once the command line is parsed
+
+
+@events.init_command_line_parser.add_listener
+def add_arguments(parser):
+    group = parser.add_argument_group("Person API scenarios")
+    group.add_argument("--dataset-size", type=int, default=1000, env_var="DATASET_SIZE")
+    group.add_argument("--dataset-seed", type=int, default=42, env_var="DATASET_SEED")
+    group.add_argument("--dataset-admins", type=int, default=1)
+    group.add_argument(
+        "--admin-password",
+        default=default_admin_password,
+        env_var="ADMIN_PASSWORD",
+    )
+    group.add_argument(
+        "--token-expiration-minutes",
+        type=float,
+        default=15,
+        env_var="PERSONAPI_AUTH_TOKEN_EXPIRATION_IN_MINUTES",
+        help="as set on the API, tokens older than that may be rejected",
+    )
+    group.add_argument(
+        "--zipf-exponent",
+        type=float,
+        default=1.1,
+        help="skew of key popularity, 0 for uniform (default: 1.1)",
+    )
+    group.add_argument("--slo-file", default="loadtest/slos.json")
+    group.add_argument(
+        "--slo-profile",
+        default="",
+        help="defaults to the profile of the scenario, if only one is run",
+    )
+    group.add_argument("--report", default="", help="write JSON results to this file")
+
+
+@events.init.add_listener
+def load_dataset(environment, **kwargs):
+    global dataset
+    options = environment.parsed_options
+    dataset = Dataset(
+        options.dataset_size, options.dataset_seed, options.dataset_admins
+    )
+
+
+@events.quitting.add_listener
+def check_slos(environment, **kwargs):
+    if isinstance(environment.runner, WorkerRunner):
+        return  # only the master has the full stats
+    options = environment.parsed_options
+    profile = options.slo_profile
+    if not profile:
+        profiles = {user_class.slo_profile for user_class in environment.user_classes}
+        profile = profiles.pop() if len(profiles) == 1 else "default"
+
+    total = environment.stats.total
+    metrics = Metrics(
+        requests=total.num_requests,
+        failures=total.num_failures,
+        rps=total.total_rps,
+        p95_ms=total.get_response_time_percentile(0.95) or 0,
+        p99_ms=total.get_response_time_percentile(0.99) or 0,
+    )
+    report = build_report(profile, metrics, load_slos(options.slo_file)[profile])
+    if options.report:
+        with open(options.report, "w") as f:
+            json.dump(report, f, indent=2)
+    print(
+        "SLO profile '%s': %s" % (profile, "PASSED" if report["passed"] else "FAILED")
+    )
+    for violation in report["violations"]:
+        print("  - " + violation)
+    environment.process_exit_code = exit_code(report)
+
+
+class PersonApiUser(HttpUser):
+    "Common behaviour for the scenarios. Tokens are acquired once and reused."
+
+    abstract = True
+    slo_profile = "default"
+    wait_time = between(0.05, 0.2)
+
+    def on_start(self):
+        options = self.environment.parsed_options
+        self.rng = random.Random()
+        # admins are left out: they are not updated, a PUT drops their
+        # credentials, and the hottest key would be one of them
+        self.popularity = ZipfSampler(
+            len(dataset.regular_people), options.zipf_exponent, self.rng
+        )
+        self.admin_cpf = self.rng.choice(dataset.admin_cpfs)
+        self.admin_password = options.admin_password
+        self.token_lifetime = options.token_expiration_minutes * 60
+        self.token = None
+        self.token_obtained_at = 0.0
+        self.created = []
+
+    def popular_person(self) -> dict:
+        return dataset.regular_people[self.popularity.sample()]
+
+    def login(self):
+        "Gets a new token, returns None if login failed."
+        response = self.client.post(
+            "/token",
+            data={
+                "grant_type": "password",
+                "username": self.admin_cpf,
+                "password": self.admin_password,
+            },
+        )
+        if response.ok:
+            return response.json()["access_token"]
+        return None
+
+    def refresh_token(self):
+        self.token = self.login()
+        self.token_obtained_at = time.monotonic()
+
+    def get_me(self):
+        if not self.token:
+            self.refresh_token()
+            if not self.token:
+                return  # the failed login is already counted as an error
+        # a few seconds of tolerance, as the clocks here and on the API differ
+        may_have_expired = (
+            time.monotonic() - self.token_obtained_at > self.token_lifetime - 5
+        )
+        with self.client.get(
+            "/users/me",
+            headers={"Authorization": "Bearer %s" % self.token},
+            catch_response=True,
+        ) as response:
+            if response.status_code == 401:
+                # log in again next time. Only an error if the token was fresh
+                self.token = None
+                if may_have_expired:
+                    response.success()
+
+    def get_person(self):
+        self.client.get("/users/" + self.popular_person()["cpf"], name="/users/{cpf}")
+
+    def get_missing_person(self):
+        with self.client.get(
+            "/users/" + fresh_cpf(self.rng), name="/users/{cpf}", catch_response=True
+        ) as response:
+            if response.status_code == 404:
+                response.success()
+
+    def count_people(self):
+        self.client.head("/users")
+
+    def list_people(self):
         self.client.get("/users")
 
-    @task
-    def get_user(self):
-        cpf = "218.254.539-50"
-        self.client.get("/users/" + cpf)
+    def create_person(self):
+        person = random_person(self.rng, fresh_cpf(self.rng))
+        with self.client.post("/users", json=person, catch_response=True) as response:
+            if response.status_code == 201:
+                self.created.append(person)
+            elif response.status_code == 409:
+                response.success()  # random CPF already taken, unlikely but fine
+
+    def update_person(self):
+        person = dict(self.popular_person())
+        person["lastName"] = self.rng.choice(["Silva", "Souza", person["lastName"]])
+        self.client.put("/users/" + person["cpf"], json=person, name="/users/{cpf}")
+
+    def delete_created_person(self):
+        if self.created:
+            person = self.created.pop()
+            self.client.delete("/users/" + person["cpf"], name="/users/{cpf}")
+
+
+class ReadHeavyUser(PersonApiUser):
+    slo_profile = "read-heavy"
+
+    @task(20)
+    def read_person(self):
+        self.get_person()
+
+    @task(5)
+    def read_me(self):
+        self.get_me()
+
+    @task(2)
+    def count(self):
+        self.count_people()
+
+    @task(1)
+    def read_missing_person(self):
+        self.get_missing_person()
+
+
+class WriteHeavyUser(PersonApiUser):
+    slo_profile = "write-heavy"
+
+    @task(5)
+    def create(self):
+        self.create_person()
+
+    @task(5)
+    def update(self):
+        self.update_person()
+
+    @task(3)
+    def delete(self):
+        self.delete_created_person()
+
+    @task(2)
+    def read_person(self):
+        self.get_person()
+
+    def on_stop(self):
+        while self.created:
+            self.delete_created_person()
+
+
+class AuthStormUser(PersonApiUser):
+    "Logs in all the time, without reusing tokens, as a misbehaving client would."
+
+    slo_profile = "auth-storm"
+
+    @task(10)
+    def login_again(self):
+        self.refresh_token()
+
+    @task(1)
+    def read_me(self):
+        self.get_me()
+
+
+class LargeListUser(PersonApiUser):
+    slo_profile = "large-list"
+
+    @task(5)
+    def list_all(self):
+        self.list_people()
+
+    @task(2)
+    def count(self):
+        self.count_people()
+
+    @task(1)
+    def exact_count(self):
+        self.client.head("/users", params={"exact_count": True}, name="/users (exact)")
@@ -1,19 +1,22 @@
 #!/usr/bin/env python
 
+import asyncio
 from typing import Any, Dict, List, Optional, Union
 
-import uvicorn
-from fastapi import Depends, FastAPI, HTTPException, status
+from fastapi import Depends, FastAPI, HTTPException, Response, status
 from fastapi.security import OAuth2PasswordBearer, OAuth2PasswordRequestForm
 from pydantic import BaseModel
 
-from .auth import AuthError, AuthProvider, Token
+from .auth import AuthError, AuthProvider, PasswordHasher, Token
+from .health import Readiness, ReadinessChecker
 from .store import User, UserInDB, UserStore
+from .tracing import TracingMiddleware, traced, tracer
 from .utils import Settings
 
 app = FastAPI(
     title="Person API", description="A toy project, a CRUD for people records."
 )
+app.add_middleware(TracingMiddleware)
 
 
 class HTTPError(BaseModel):
@@ -46,10 +49,23 @@ def get_settings():  # pragma: no cover - this is overridden in tests
     return Settings()
 
 
+@app.on_event("startup")
+def configure_tracing():  # pragma: no cover - tests set the exporter directly
+    settings = get_settings()
+    tracer.configure(settings.tracing_exporter, settings.auth_token_base_secret)
+
+
+@traced()
 async def get_user_store(settings: Settings = Depends(get_settings)):
-    return UserStore(settings.db_conn_str, settings.simulated_delay_seconds)
+    return UserStore(
+        settings.db_partitions or settings.db_conn_str,
+        settings.simulated_delay_seconds,
+        settings.count_cache_seconds,
+        settings.db_partitions_migrating,
+    )
 
 
+@traced()
 def get_auth_provider(
     settings: Settings = Depends(get_settings),
     user_store: UserStore = Depends(get_user_store),
@@ -59,9 +75,24 @@ def get_auth_provider(
         settings.auth_token_algorithm,
         settings.auth_token_expiration_in_minutes,
         user_store,
+        PasswordHasher.from_settings(settings),
+    )
+
+
+def get_readiness_checker(
+    settings: Settings = Depends(get_settings),
+    user_store: UserStore = Depends(get_user_store),
+):
+    return ReadinessChecker(
+        user_store,
+        settings.readiness_cache_seconds,
+        settings.readiness_ping_timeout_seconds,
+        settings.readiness_max_pool_saturation,
+        settings.readiness_max_event_loop_lag_seconds,
     )
 
 
+@traced()
 async def validate_token(
     auth: AuthProvider = Depends(get_auth_provider),
     token: str = Depends(oauth2_scheme),
@@ -87,7 +118,31 @@ async def get_existing_user(user_store: UserStore, cpf: str) -> User:
     return user
 
 
+@app.get("/healthz")
+async def healthz():
+    "Liveness probe. Does no I/O, answering is enough to prove the process is alive."
+    return {"status": "ok"}
+
+
+@app.get(
+    "/readyz",
+    response_model=Readiness,
+    responses={status.HTTP_503_SERVICE_UNAVAILABLE: {"model": Readiness}},
+)
+@traced()
+async def readyz(
+    response: Response,
+    readiness_checker: ReadinessChecker = Depends(get_readiness_checker),
+):
+    "Readiness probe. Checks MongoDB and load, with the result cached for a while."
+    readiness = await readiness_checker.check()
+    if not readiness.ready:
+        response.status_code = status.HTTP_503_SERVICE_UNAVAILABLE
+    return readiness
+
+
 @app.post("/%s" % token_url, response_model=Token)
+@traced()
 async def login_for_access_token(
     auth: AuthProvider = Depends(get_auth_provider),
     form_data: OAuth2PasswordRequestForm = Depends(),
@@ -103,17 +158,51 @@ async def login_for_access_token(
     return token
 
 
-@app.get("/users", response_model=List[User])
-async def users_get_all(user_store: UserStore = Depends(get_user_store)):
-    return await user_store.get_all()
+total_count_header = "X-Total-Count"
+total_count_responses: Optional[Dict[Union[int, str], Dict[str, Any]]] = {
+    status.HTTP_200_OK: {
+        "headers": {
+            total_count_header: {
+                "description": "Number of registered people",
+                "schema": {"type": "integer"},
+            }
+        }
+    }
+}
+
+
+@app.get("/users", response_model=List[User], responses=total_count_responses)
+@traced()
+async def users_get_all(
+    response: Response,
+    exact_count: bool = False,
+    user_store: UserStore = Depends(get_user_store),
+):
+    users, count = await asyncio.gather(
+        user_store.get_all(), user_store.count(exact=exact_count)
+    )
+    response.headers[total_count_header] = str(count)
+    return users
+
+
+@app.head("/users", responses=total_count_responses)
+@traced()
+async def users_count(
+    exact_count: bool = False, user_store: UserStore = Depends(get_user_store)
+):
+    "Returns only the number of registered people, on the X-Total-Count header."
+    count = await user_store.count(exact=exact_count)
+    return Response(headers={total_count_header: str(count)})
 
 
 @app.get("/users/me", response_model=User)
+@traced()
 async def auth_test(user: str = Depends(validate_token)):
     return user
 
 
 @app.get("/users/{cpf}", response_model=User, responses=response_ok_or_notfound)
+@traced()
 async def users_get_one(cpf: str, user_store: UserStore = Depends(get_user_store)):
     return await get_existing_user(user_store, cpf)
 
@@ -130,6 +219,7 @@ async def users_get_one(cpf: str, user_store: UserStore = Depends(get_user_store
         },
     },
 )
+@traced()
 async def users_post(user: User, user_store: UserStore = Depends(get_user_store)):
     if await user_store.get(user.cpf):
         raise HTTPException(
@@ -151,6 +241,7 @@ async def users_post(user: User, user_store: UserStore = Depends(get_user_store)
         },
     },
 )
+@traced()
 async def users_put(
     cpf: str, user: User, user_store: UserStore = Depends(get_user_store)
 ):
@@ -167,6 +258,7 @@ async def users_put(
 
 
 @app.delete("/users/{cpf}", response_model=User, responses=response_ok_or_notfound)
+@traced()
 async def users_delete(cpf: str, user_store: UserStore = Depends(get_user_store)):
     # will throw exception if user does not exist
     user = await get_existing_user(user_store, cpf)
@@ -175,4 +267,6 @@ async def users_delete(cpf: str, user_store: UserStore = Depends(get_user_store)
 
 
 if __name__ == "__main__":  # pragma: no cover
+    import uvicorn
+
     uvicorn.run(app, host="127.0.0.1", port=8000)
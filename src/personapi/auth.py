@@ -3,14 +3,17 @@
 Auth support for the Person API
 """
 
+import os
 from datetime import datetime, timedelta
+from functools import lru_cache
+from time import perf_counter
+from typing import Optional
 
-from jose import JWTError, jwt
-from passlib.context import CryptContext
 from pydantic import BaseModel
 
 from .store import UserInDB, UserStore
-from .utils import SingletonMeta
+from .tracing import hash_cpf, traced, tracer
+from .utils import Settings, SingletonMeta
 
 
 class AuthError(Exception):
@@ -45,47 +48,85 @@ class AuthProvider(metaclass=SingletonMeta):
         token_algorithm: str,
         token_expiration_in_minutes: int,
         user_store: UserStore,
+        password_hasher: Optional["PasswordHasher"] = None,
     ):
         self.token_base_secret = token_base_secret
         self.token_algorithm = token_algorithm
         self.auth_token_expiration_in_minutes = token_expiration_in_minutes
         self.user_store = user_store
-        self.password_hasher = PasswordHasher()
+        self.password_hasher = password_hasher or PasswordHasher()
 
     async def auth_user(self, username: str, password: str) -> Token:
-        user = await self.user_store.get(username)
-        if not user:
-            raise InvalidUser("Cannot find '%s' user" % username)
-        elif not user.isAdmin:
-            raise InvalidUser(
-                "User '%s' is not an admin. User must be an Admin to be allowed access."
-                % username
-            )
-        elif not self.password_hasher.verify(password, user.hashedPassword):
-            raise WrongPassword
-        else:
-            return self._create_access_token(data={"sub": user.cpf})
-
-    async def validate_token(self, token: str) -> UserInDB:
+        with tracer.start_span("AuthProvider.auth_user") as span:
+            if span.is_recording:
+                span.set_attribute("personapi.cpf_hash", hash_cpf(username))
+            user = await self.user_store.get(username)
+            if not user:
+                raise InvalidUser("Cannot find '%s' user" % username)
+            elif not user.isAdmin:
+                raise InvalidUser(
+                    "User '%s' is not an admin. "
+                    "User must be an Admin to be allowed access." % username
+                )
+            elif not self.password_hasher.verify(password, user.hashedPassword):
+                raise WrongPassword
+            else:
+                if self.password_hasher.needs_update(user.hashedPassword):
+                    span.set_attribute(
+                        "personapi.password_rehashed",
+                        await self._rehash(user, password),
+                    )
+                return self._create_access_token(data={"sub": user.cpf})
+
+    async def _rehash(self, user: UserInDB, password: str) -> bool:
+        """Replaces an outdated hash, returning whether it worked.
+
+        The hash was made with an outdated scheme or cost, and login is the only
+        moment we have the plain password to make a new one. That is opportunistic:
+        a failure here must not fail the login, it will be retried on the next one.
+        """
         try:
-            payload = jwt.decode(
-                token, self.token_base_secret, algorithms=self.token_algorithm
+            await self.user_store.set_password_hash(
+                user.cpf, self.password_hasher.get_hash(password)
             )
-            username: str = payload.get("sub")
-            if username is None:
-                return TokenValidationError("Token does not specify user")
-            token_data = TokenData(username=username)
-        except JWTError:
-            raise TokenValidationError("Error decoding token")
-
-        user = await self.user_store.get(token_data.username)
-        if user is None:
-            raise TokenValidationError("User not found")
+            return True
+        except Exception as exc:
+            print(
+                "[PID %d] Could not rehash password of user %s: %r"
+                % (os.getpid(), hash_cpf(user.cpf), exc)
+            )
+            return False
 
-        return user
+    async def validate_token(self, token: str) -> UserInDB:
+        from jose import JWTError, jwt  # lazy, see _create_access_token
+
+        with tracer.start_span("AuthProvider.validate_token") as span:
+            try:
+                with tracer.start_span("jwt.decode"):
+                    payload = jwt.decode(
+                        token, self.token_base_secret, algorithms=self.token_algorithm
+                    )
+                username: str = payload.get("sub")
+                if username is None:
+                    return TokenValidationError("Token does not specify user")
+                token_data = TokenData(username=username)
+            except JWTError:
+                raise TokenValidationError("Error decoding token")
+
+            if span.is_recording:
+                span.set_attribute("personapi.cpf_hash", hash_cpf(token_data.username))
+            user = await self.user_store.get(token_data.username)
+            if user is None:
+                raise TokenValidationError("User not found")
+
+            return user
 
     def _create_access_token(self, data: dict) -> Token:
         "Generates an access Token using JWT"
+        # jose (and cryptography under it) is slow to import, and only needed by
+        # the few routes requiring auth, so it is imported on first use
+        from jose import jwt
+
         to_encode = data.copy()
 
         expiration_time = datetime.utcnow() + timedelta(
@@ -100,14 +141,109 @@ class AuthProvider(metaclass=SingletonMeta):
         return Token(access_token=encoded_jwt, token_type="bearer")  # nosec
 
 
+# Cost parameter bounds accepted by each supported scheme. For bcrypt the cost is
+# log2 of the number of rounds, for argon2 it is the time_cost (iterations).
+HASH_COST_BOUNDS = {
+    "bcrypt": (4, 31),
+    "argon2": (1, 64),
+}
+
+
 class PasswordHasher:
-    "Manages password hashes using passlib"
+    """Manages password hashes using passlib
 
-    def __init__(self):
-        self.pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
+    The configured scheme and cost are the only ones considered up to date. Hashes
+    made with any other supported scheme or cost still verify, but are reported by
+    `needs_update` so they can be replaced on the next successful login.
 
+    argon2 is optional and requires the argon2-cffi package to be installed.
+    """
+
+    def __init__(
+        self, scheme: str = "bcrypt", cost: int = 12, argon2_memory_cost: int = 65536
+    ):
+        if scheme not in HASH_COST_BOUNDS:
+            raise ValueError("Unsupported password hash scheme: %s" % scheme)
+        min_cost, max_cost = HASH_COST_BOUNDS[scheme]
+        if not min_cost <= cost <= max_cost:
+            raise ValueError(
+                "Cost for %s must be between %d and %d" % (scheme, min_cost, max_cost)
+            )
+
+        # passlib and the hash backends are only imported on first use, to keep
+        # them out of the API cold start
+        from passlib.context import CryptContext
+
+        self.scheme = scheme
+        self.cost = cost
+        # the configured scheme goes first (the default), the others are kept
+        # only for verifying old hashes and are marked deprecated
+        schemes = [scheme] + [s for s in HASH_COST_BOUNDS if s != scheme]
+        self.pwd_context = CryptContext(
+            schemes=schemes,
+            deprecated="auto",
+            argon2__memory_cost=argon2_memory_cost,
+            **{
+                "%s__%s" % (scheme, option): cost
+                for option in ("default_rounds", "min_rounds", "max_rounds")
+            },
+        )
+        # fail early if the backend for the configured scheme is missing
+        self.pwd_context.handler(scheme).get_backend()
+
+    @classmethod
+    def from_settings(cls, settings: Settings) -> "PasswordHasher":
+        "Returns a (cached) hasher configured as specified in settings."
+        return _cached_password_hasher(
+            settings.password_hash_scheme,
+            settings.password_hash_cost,
+            settings.password_hash_argon2_memory_cost,
+        )
+
+    @traced("PasswordHasher.verify")
     def verify(self, plain_password, hashed_password):
         return self.pwd_context.verify(plain_password, hashed_password)
 
+    @traced("PasswordHasher.get_hash")
     def get_hash(self, password):
         return self.pwd_context.hash(password)
+
+    def needs_update(self, hashed_password) -> bool:
+        "Tells if the hash was not made with the current scheme and cost."
+        return self.pwd_context.needs_update(hashed_password)
+
+    def time_verify(self, samples: int = 3) -> float:
+        "Returns the best time in seconds, among samples, to verify a password."
+        password = "calibration-password"  # nosec: not a real secret
+        hashed_password = self.get_hash(password)
+        timings = []
+        for _ in range(samples):
+            start = perf_counter()
+            self.verify(password, hashed_password)
+            timings.append(perf_counter() - start)
+        return min(timings)
+
+
+_cached_password_hasher = lru_cache(maxsize=None)(PasswordHasher)
+
+
+def calibrate_hash_cost(
+    target_seconds: float,
+    scheme: str = "bcrypt",
+    argon2_memory_cost: int = 65536,
+    samples: int = 3,
+) -> int:
+    """Finds the highest cost whose verify time on this host is within target.
+
+    The cost is increased one step at a time, so the search stops right after the
+    first cost that goes over the target. Returns the minimum cost for the scheme
+    if even that is slower than the target.
+    """
+    min_cost, max_cost = HASH_COST_BOUNDS[scheme]
+    best = min_cost
+    for cost in range(min_cost, max_cost + 1):
+        hasher = PasswordHasher(scheme, cost, argon2_memory_cost)
+        if hasher.time_verify(samples) > target_seconds:
+            break
+        best = cost
+    return best
@@ -0,0 +1,48 @@
+#!/usr/bin/env python
+"""
+Benchmarks password hashing on this host and recommends a cost setting.
+
+Run it on the same kind of host the API will run on:
+
+    python -m personapi.calibrate --target-ms 250
+"""
+
+import argparse
+
+from .auth import HASH_COST_BOUNDS, PasswordHasher, calibrate_hash_cost
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument(
+        "--target-ms",
+        type=float,
+        default=250,
+        help="maximum time to verify a password, in milliseconds (default: 250)",
+    )
+    parser.add_argument("--scheme", choices=sorted(HASH_COST_BOUNDS), default="bcrypt")
+    parser.add_argument(
+        "--argon2-memory-cost",
+        type=int,
+        default=65536,
+        help="argon2 memory cost in KiB, ignored for bcrypt (default: 65536)",
+    )
+    parser.add_argument("--samples", type=int, default=3)
+    args = parser.parse_args(argv)
+
+    cost = calibrate_hash_cost(
+        args.target_ms / 1000, args.scheme, args.argon2_memory_cost, args.samples
+    )
+    hasher = PasswordHasher(args.scheme, cost, args.argon2_memory_cost)
+    print(
+        "%s cost %d verifies in %.1f ms (target: %.1f ms)"
+        % (args.scheme, cost, hasher.time_verify(args.samples) * 1000, args.target_ms)
+    )
+    print("PERSONAPI_PASSWORD_HASH_SCHEME=%s" % args.scheme)
+    print("PERSONAPI_PASSWORD_HASH_COST=%d" % cost)
+    if args.scheme == "argon2":
+        print("PERSONAPI_PASSWORD_HASH_ARGON2_MEMORY_COST=%d" % args.argon2_memory_cost)
+
+
+if __name__ == "__main__":  # pragma: no cover
+    main()
@@ -0,0 +1,121 @@
+#!/usr/bin/env python
+"""
+Readiness checks for the Person API.
+
+The API sheds load by reporting itself not ready, so the load balancer sends
+traffic elsewhere, when its MongoDB connection pool is nearly saturated or its event
+loop lags behind. Those thresholds, from settings, are the only shedding signal.
+
+Probes are frequent, so the result of a check is cached for a while, and concurrent
+probes arriving while a check is running wait for that same check instead of
+starting their own.
+"""
+
+import asyncio
+import os
+import time
+from typing import List, Optional
+
+from pydantic import BaseModel
+
+from .store import UserStore
+from .utils import SingletonMeta
+
+
+class Readiness(BaseModel):
+    ready: bool
+    mongodb: bool
+    pool_saturation: float
+    event_loop_lag_seconds: float
+    load_shedding: bool
+    reasons: List[str] = []
+
+    class Config:
+        schema_extra = {
+            "example": {
+                "ready": True,
+                "mongodb": True,
+                "pool_saturation": 0.05,
+                "event_loop_lag_seconds": 0.0001,
+                "load_shedding": False,
+                "reasons": [],
+            }
+        }
+
+
+async def measure_event_loop_lag() -> float:
+    "Returns how long it takes for this task to be scheduled again, in seconds."
+    start = time.perf_counter()
+    await asyncio.sleep(0)
+    return time.perf_counter() - start
+
+
+class ReadinessChecker(metaclass=SingletonMeta):
+    def __init__(
+        self,
+        user_store: UserStore,
+        cache_seconds: float,
+        ping_timeout_seconds: float,
+        max_pool_saturation: float,
+        max_event_loop_lag_seconds: float,
+    ):
+        self.user_store = user_store
+        self.cache_seconds = cache_seconds
+        self.ping_timeout_seconds = ping_timeout_seconds
+        self.max_pool_saturation = max_pool_saturation
+        self.max_event_loop_lag_seconds = max_event_loop_lag_seconds
+        self._result: Optional[Readiness] = None
+        self._checked_at = 0.0
+        self._running: Optional[asyncio.Future] = None
+
+    async def check(self) -> Readiness:
+        "Returns the readiness, from cache if it is recent enough."
+        if (
+            self._result is not None
+            and time.monotonic() - self._checked_at < self.cache_seconds
+        ):
+            return self._result
+        if self._running is None:
+            self._running = asyncio.ensure_future(self._check())
+            self._running.add_done_callback(self._clear_running)
+        # shield, so a probe giving up does not cancel the check for the others
+        return await asyncio.shield(self._running)
+
+    def _clear_running(self, future: asyncio.Future) -> None:
+        self._running = None
+
+    async def _check(self) -> Readiness:
+        reasons = []
+        lag = await measure_event_loop_lag()
+
+        try:
+            await asyncio.wait_for(
+                self.user_store.ping(), timeout=self.ping_timeout_seconds
+            )
+            mongodb = True
+        except Exception as exc:
+            mongodb = False
+            # the error details (hosts, ports, topology) stay in the server log,
+            # as /readyz is public
+            print("[PID %d] Readiness: MongoDB ping failed: %r" % (os.getpid(), exc))
+            reasons.append("MongoDB ping failed")
+
+        shedding_reasons = []
+        saturation = self.user_store.pool_saturation()
+        if saturation >= self.max_pool_saturation:
+            shedding_reasons.append("MongoDB connection pool saturated")
+        if lag > self.max_event_loop_lag_seconds:
+            shedding_reasons.append("Event loop lagging")
+        reasons += shedding_reasons
+
+        result = Readiness(
+            ready=not reasons,
+            mongodb=mongodb,
+            pool_saturation=saturation,
+            event_loop_lag_seconds=lag,
+            load_shedding=bool(shedding_reasons),
+            reasons=reasons,
+        )
+        self._result = result
+        self._checked_at = time.monotonic()
+        return result
@@ -0,0 +1,28 @@
+#!/usr/bin/env python
+"""
+Routing of users to MongoDB partitions, by CPF.
+
+Uses rendezvous (highest random weight) hashing: each CPF goes to the partition
+scoring highest for it. Partitions are identified by their position in the list,
+so new ones must be appended. When that happens, only the CPFs the new partition
+wins move, about 1/n of them, and every other CPF stays where it was.
+"""
+
+import hashlib
+
+
+def cpf_digits(cpf: str) -> str:
+    "The CPF without formatting, so formatted and plain CPFs route the same."
+    return "".join(c for c in cpf if c.isdigit())
+
+
+def partition_index(cpf: str, partitions: int) -> int:
+    "Returns the index of the partition owning cpf, among the given number of them."
+    if partitions == 1:
+        return 0
+    key = cpf_digits(cpf)
+    scores = [
+        hashlib.sha256(("%d:%s" % (i, key)).encode()).digest()[:8]
+        for i in range(partitions)
+    ]
+    return scores.index(max(scores))
@@ -0,0 +1,58 @@
+#!/usr/bin/env python
+"""
+MongoDB connection pool monitoring.
+
+Kept apart from the store module because it needs pymongo at import time, and
+pymongo should only be loaded once the store is created.
+"""
+
+from collections import defaultdict
+from typing import Dict
+
+from pymongo.monitoring import ConnectionPoolListener
+
+
+class PoolUsageListener(ConnectionPoolListener):
+    "Keeps count of the connections checked out of each server's pool."
+
+    def __init__(self):
+        self.checked_out: Dict[tuple, int] = defaultdict(int)
+
+    def connection_checked_out(self, event):
+        self.checked_out[event.address] += 1
+
+    def connection_checked_in(self, event):
+        self.checked_out[event.address] -= 1
+
+    def pool_closed(self, event):
+        self.checked_out.pop(event.address, None)
+
+    def most_used(self) -> int:
+        "Number of connections in use on the busiest pool."
+        return max(self.checked_out.values(), default=0)
+
+    # the events below are not needed, but pymongo requires them all handled
+
+    def pool_created(self, event):
+        pass
+
+    def pool_ready(self, event):
+        pass
+
+    def pool_cleared(self, event):
+        pass
+
+    def connection_created(self, event):
+        pass
+
+    def connection_ready(self, event):
+        pass
+
+    def connection_closed(self, event):
+        pass
+
+    def connection_check_out_started(self, event):
+        pass
+
+    def connection_check_out_failed(self, event):
+        pass
@@ -0,0 +1,93 @@
+#!/usr/bin/env python
+"""
+Moves users to the partition their CPF routes to, after partitions were added.
+
+To add partitions without downtime:
+
+1. Append the new connection strings to PERSONAPI_DB_PARTITIONS and set
+   PERSONAPI_DB_PARTITIONS_MIGRATING=true on the API.
+2. Run this, with the same partitions:
+
+       python -m personapi.rebalance --dry-run
+       python -m personapi.rebalance
+
+3. Set PERSONAPI_DB_PARTITIONS_MIGRATING back to false.
+
+Partitions default to the ones in PERSONAPI_DB_PARTITIONS.
+"""
+
+import argparse
+import json
+import os
+from collections import Counter
+from typing import Dict, Tuple
+
+from .partitioning import partition_index
+
+
+def rebalance(collections: list, dry_run: bool = False) -> Dict[Tuple[int, int], int]:
+    """Moves each user not in its partition to the right one.
+
+    A user already in the right partition was written there by the API while
+    migrating, so that copy is kept and the misplaced one just dropped.
+
+    Each user is copied before being deleted from its old partition, so stopping
+    this at any point loses no one: running it again finishes the move. If the
+    old copy was already gone, the API removed the user in the meantime, and the
+    new copy is dropped too, unless the API changed it since.
+
+    Returns the number of users moved, by (from, to) partition indexes.
+    """
+    for collection in collections:
+        collection.create_index("cpf", unique=True)
+
+    moves: Dict[Tuple[int, int], int] = Counter()
+    for source_index, source in enumerate(collections):
+        for doc in source.find({}):
+            target_index = partition_index(doc["cpf"], len(collections))
+            if target_index == source_index:
+                continue
+            if dry_run:
+                moves[(source_index, target_index)] += 1
+                continue
+            doc_id = doc.pop("_id")
+            target = collections[target_index]
+            copied = target.update_one(
+                {"cpf": doc["cpf"]}, {"$setOnInsert": doc}, upsert=True
+            )
+            if source.delete_one({"_id": doc_id}).deleted_count:
+                moves[(source_index, target_index)] += 1
+            elif copied.upserted_id is not None:
+                # matching all fields, so an update made since is kept
+                target.delete_one(dict(doc, _id=copied.upserted_id))
+    return dict(moves)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument(
+        "--partitions",
+        default=os.environ.get("PERSONAPI_DB_PARTITIONS", "[]"),
+        help="connection strings, as a JSON list, in the order the API uses",
+    )
+    parser.add_argument("--dry-run", action="store_true", help="only count moves")
+    args = parser.parse_args(argv)
+
+    from pymongo import MongoClient
+
+    conn_strings = json.loads(args.partitions)
+    if len(conn_strings) < 2:
+        parser.error("at least 2 partitions are needed")
+    collections = [MongoClient(c)["people"].users for c in conn_strings]
+    moves = rebalance(collections, args.dry_run)
+    for (source, target), count in sorted(moves.items()):
+        print(
+            "%s %d users from partition %d to %d"
+            % ("Would move" if args.dry_run else "Moved", count, source, target)
+        )
+    if not moves:
+        print("All users are in the right partition")
+
+
+if __name__ == "__main__":  # pragma: no cover
+    main()
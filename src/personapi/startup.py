@@ -0,0 +1,175 @@
+#!/usr/bin/env python
+"""
+Measures the Person API cold start: import time and time to first request.
+
+Each measurement runs on a fresh interpreter, as a new pod would:
+
+    python -m personapi.startup --budget-import-ms 1000 --budget-first-request-ms 3000
+
+Besides the import of the API, the load time of the dependencies it defers is
+measured too: that cost is paid by the first requests instead. Time to first
+request is measured twice: on /healthz, which does no I/O, and on a request using
+the store (GET /users), which needs the database in PERSONAPI_DB_CONN_STR to be up.
+
+Exits with status 1 if any of the given budgets is exceeded.
+"""
+
+import argparse
+import os
+import socket
+import subprocess  # nosec: only runs the current interpreter, with fixed args
+import sys
+import time
+import urllib.error
+import urllib.request
+from typing import Dict, List, Optional
+
+# dependencies that should not be loaded just by importing the API
+LAZY_MODULES = ["bradocs4py", "jose", "motor", "passlib", "pymongo", "uvicorn"]
+# what the API imports of them on first use (uvicorn is only for running it)
+LAZY_IMPORTS = [
+    "bradocs4py",
+    "jose.jwt",
+    "motor.motor_asyncio",
+    "passlib.context",
+    "personapi.pool",
+]
+
+_import_script = """
+import sys, time
+{preload}
+start = time.perf_counter()
+{imports}
+print(time.perf_counter() - start)
+print(",".join(m for m in sys.argv[1:] if m in sys.modules))
+"""
+
+
+def _import_in_fresh_interpreter(modules: List[str], preload: List[str] = ()):
+    script = _import_script.format(
+        preload="\n".join("import " + m for m in preload),
+        imports="\n".join("import " + m for m in modules),
+    )
+    output = subprocess.run(  # nosec
+        [sys.executable, "-c", script] + LAZY_MODULES,
+        check=True,
+        capture_output=True,
+        text=True,
+    ).stdout.splitlines()
+    loaded = output[1].split(",") if len(output) > 1 and output[1] else []
+    return float(output[0]), loaded
+
+
+def measure_import_time(module: str = "personapi.api") -> float:
+    "Returns the time in seconds to import module on a fresh interpreter."
+    return _import_in_fresh_interpreter([module])[0]
+
+
+def measure_lazy_import_time(module: str = "personapi.api") -> float:
+    """Returns the time in seconds to load the dependencies module defers.
+
+    That is the cost moved from the import to the first requests using them.
+    """
+    return _import_in_fresh_interpreter(LAZY_IMPORTS, preload=[module])[0]
+
+
+def eagerly_loaded_modules(module: str = "personapi.api") -> List[str]:
+    "Returns which of LAZY_MODULES are loaded by just importing module."
+    return _import_in_fresh_interpreter([module])[1]
+
+
+def _free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def measure_time_to_first_request(
+    path: str = "/healthz", timeout: float = 30, env: Optional[Dict[str, str]] = None
+) -> float:
+    """Returns the time in seconds from starting the server to a successful request.
+
+    The server is started with uvicorn on a random local port, with env added to
+    its environment, and polled until path answers with a 2xx status.
+    """
+    port = _free_port()
+    env = dict(os.environ, **(env or {}))
+    # settings are loaded at startup, so a secret must be present
+    env.setdefault("PERSONAPI_AUTH_TOKEN_BASE_SECRET", "startup-measurement")
+    url = "http://127.0.0.1:%d%s" % (port, path)
+
+    start = time.perf_counter()
+    server = subprocess.Popen(  # nosec
+        [sys.executable, "-m", "uvicorn", "--port", str(port), "personapi.api:app"],
+        env=env,
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.DEVNULL,
+    )
+    try:
+        while time.perf_counter() - start < timeout:
+            try:
+                with urllib.request.urlopen(url, timeout=1) as response:  # nosec
+                    if 200 <= response.status < 300:
+                        return time.perf_counter() - start
+            except (urllib.error.URLError, ConnectionError):
+                pass
+            if server.poll() is not None:
+                raise RuntimeError("Server exited with status %d" % server.returncode)
+            time.sleep(0.01)
+        raise TimeoutError("No successful response from %s in %ss" % (url, timeout))
+    finally:
+        server.terminate()
+        server.wait()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--path", default="/healthz", help="path of the first request")
+    parser.add_argument(
+        "--store-path",
+        default="/users",
+        help="path of the first request using the store, needs the database",
+    )
+    parser.add_argument(
+        "--no-store", action="store_true", help="skip the request using the store"
+    )
+    parser.add_argument("--budget-import-ms", type=float)
+    parser.add_argument("--budget-lazy-import-ms", type=float)
+    parser.add_argument("--budget-first-request-ms", type=float)
+    parser.add_argument("--budget-first-store-request-ms", type=float)
+    args = parser.parse_args(argv)
+
+    measurements = [
+        ("import time", measure_import_time(), args.budget_import_ms),
+        (
+            "deferred dependencies load time",
+            measure_lazy_import_time(),
+            args.budget_lazy_import_ms,
+        ),
+        (
+            "time to first request (%s)" % args.path,
+            measure_time_to_first_request(args.path),
+            args.budget_first_request_ms,
+        ),
+    ]
+    if not args.no_store:
+        measurements.append(
+            (
+                "time to first request (%s)" % args.store_path,
+                measure_time_to_first_request(args.store_path),
+                args.budget_first_store_request_ms,
+            )
+        )
+
+    over_budget = False
+    for name, seconds, budget in measurements:
+        value = seconds * 1000
+        print("%s: %.1f ms" % (name, value))
+        if budget is not None and value > budget:
+            print("%s over budget: %.1f ms > %.1f ms" % (name, value, budget))
+            over_budget = True
+    return 1 if over_budget else 0
+
+
+if __name__ == "__main__":  # pragma: no cover
+    sys.exit(main())
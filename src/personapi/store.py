@@ -1,14 +1,17 @@
 #!/usr/bin/env python
 
+import heapq
 import os
-from asyncio import sleep
+import time
+from asyncio import gather, sleep
 from datetime import date, datetime
-from typing import List, Optional, Union
+from itertools import islice
+from typing import Dict, List, Optional, Tuple, Union
 
-from bradocs4py import CPF
-from motor.motor_asyncio import AsyncIOMotorClient
 from pydantic import BaseModel, EmailStr, validator
 
+from .partitioning import partition_index
+from .tracing import hash_cpf, tracer
 from .utils import SingletonMeta
 
 # hard coded limit for th sake of laziness and not implementing pagination
@@ -24,6 +27,8 @@ class User(BaseModel):
 
     @validator("cpf")
     def cpf_validator(cls, cpf_str):
+        from bradocs4py import CPF  # lazy, only needed once data comes in
+
         cpf = CPF(cpf_str)
         # not declaring the field itself as CPF type to avoid fuzz with pymongo
         if cpf.isValid:
@@ -59,40 +64,274 @@ class UserInDB(User):
     hashedPassword: Optional[str] = None
 
 
+def _db_span(operation: str):
+    "Returns a span for a command sent to MongoDB."
+    return tracer.start_span(
+        "mongodb." + operation,
+        {
+            "db.system": "mongodb",
+            "db.name": "people",
+            "db.collection": "users",
+            "db.operation": operation,
+        },
+    )
+
+
+def _store_span(method: str, cpf: Optional[str] = None):
+    "Returns a span for a UserStore method, tagged with the (hashed) cpf if given."
+    span = tracer.start_span("UserStore." + method)
+    if cpf is not None and span.is_recording:
+        span.set_attribute("personapi.cpf_hash", hash_cpf(cpf))
+    return span
+
+
+class CountCache:
+    """Short lived cache for user counts, estimated and exact.
+
+    Inserts and deletes adjust the cached counts in place, as their effect on them
+    is known, so writes don't force counting again.
+    """
+
+    def __init__(self, ttl_seconds: float):
+        self.ttl_seconds = ttl_seconds
+        self._counts: Dict[bool, Tuple[float, int]] = {}
+
+    def get(self, exact: bool) -> Optional[int]:
+        "Returns the cached count, or None if there is none or it is too old."
+        cached = self._counts.get(exact)
+        if cached is None or time.monotonic() - cached[0] >= self.ttl_seconds:
+            return None
+        return cached[1]
+
+    def set(self, exact: bool, count: int) -> None:
+        self._counts[exact] = (time.monotonic(), count)
+
+    def adjust(self, delta: int) -> None:
+        "Applies a change in the number of users to the cached counts."
+        for exact, (cached_at, count) in self._counts.items():
+            self._counts[exact] = (cached_at, max(count + delta, 0))
+
+
 class UserStore(metaclass=SingletonMeta):
-    def __init__(self, conn_string: str, simulated_delay_seconds=0):
-        print("[PID %d] Connecting to %s" % (os.getpid(), conn_string))
-        self.client = AsyncIOMotorClient(conn_string)
-        self.db = self.client["people"]
-        self.simulated_delay_seconds = simulated_delay_seconds
+    """Stores users in one or more MongoDB partitions.
+
+    Each user lives in the partition its CPF routes to (see partitioning), so
+    single user operations touch one partition only, while listing and counting
+    query all of them in parallel and merge the results.
+
+    While migrating, that is, while partitions are being rebalanced, users may
+    still be in their old partition: reads missing on the right partition look in
+    the others, and writes make sure no stale copy is left behind.
+    """
+
+    def __init__(
+        self,
+        conn_string: Union[str, List[str]],
+        simulated_delay_seconds=0,
+        count_cache_seconds=5,
+        migrating=False,
+    ):
+        # motor and pymongo are heavy to import, so that is left for the first
+        # request needing the store, instead of slowing down the API cold start
+        from motor.motor_asyncio import AsyncIOMotorClient
+
+        from .pool import PoolUsageListener
+
+        conn_strings = [conn_string] if isinstance(conn_string, str) else conn_string
+        self.pool_usage = PoolUsageListener()
+        self.clients = []
+        for conn_str in conn_strings:
+            print("[PID %d] Connecting to %s" % (os.getpid(), conn_str))
+            self.clients.append(
+                AsyncIOMotorClient(conn_str, event_listeners=[self.pool_usage])
+            )
+        self._setup(
+            [client["people"].users for client in self.clients],
+            simulated_delay_seconds,
+            count_cache_seconds,
+            migrating,
+        )
         print("[PID %d] New MongoDB connection opened." % os.getpid())
 
+    @classmethod
+    def from_collections(
+        cls,
+        collections: list,
+        simulated_delay_seconds=0,
+        count_cache_seconds=5,
+        migrating=False,
+    ) -> "UserStore":
+        """Returns a new store over existing collections, one per partition.
+
+        Does no connection management, and is not a singleton. Meant for tests and
+        tools, which may use stand-ins for the collections.
+        """
+        store = object.__new__(cls)
+        store.clients = []
+        store.pool_usage = None
+        store._setup(
+            collections, simulated_delay_seconds, count_cache_seconds, migrating
+        )
+        return store
+
+    def _setup(
+        self, partitions, simulated_delay_seconds, count_cache_seconds, migrating
+    ):
+        self.partitions = partitions
+        self.simulated_delay_seconds = simulated_delay_seconds
+        self.count_cache = CountCache(count_cache_seconds)
+        self.migrating = migrating
+        self._indexes_ensured = False
+
+    async def _ensure_indexes(self) -> None:
+        """Makes sure every partition has a unique index on cpf.
+
+        Done once, on the first use of the store. Indexes persist in MongoDB, so a
+        failure is only logged: another pod, or the next start, will retry.
+        """
+        if self._indexes_ensured:
+            return
+        self._indexes_ensured = True
+        try:
+            with _db_span("create_index"):
+                await gather(
+                    *[p.create_index("cpf", unique=True) for p in self.partitions]
+                )
+        except Exception as exc:
+            print("[PID %d] Could not create index on cpf: %r" % (os.getpid(), exc))
+
+    def _partition(self, cpf: str, span=None):
+        "Returns the collection owning cpf, tagging span with its index."
+        index = partition_index(cpf, len(self.partitions))
+        if span is not None:
+            span.set_attribute("personapi.partition", index)
+        return self.partitions[index]
+
+    def _other_partitions(self, cpf: str) -> list:
+        owner = self._partition(cpf)
+        return [p for p in self.partitions if p is not owner]
+
+    async def ping(self) -> None:
+        "Checks all partitions answer. Raises an exception if any does not."
+        with _store_span("ping"), _db_span("ping"):
+            await gather(*[p.database.command("ping") for p in self.partitions])
+
+    def pool_saturation(self) -> float:
+        "Fraction of the busiest connection pool currently in use, from 0 to 1."
+        if not self.clients:
+            return 0.0
+        max_pool_size = self.clients[0].options.pool_options.max_pool_size
+        if not max_pool_size:
+            return 0.0  # unbounded pool
+        return self.pool_usage.most_used() / max_pool_size
+
     async def add(self, user: User) -> None:
         "Inserts user into the database."
-        await self.db.users.insert_one(dict(user))
+        await self._ensure_indexes()
+        with _store_span("add", user.cpf) as span, _db_span("insert_one"):
+            await self._partition(user.cpf, span).insert_one(dict(user))
+        self.count_cache.adjust(+1)
 
     async def update(self, cpf: str, user: User) -> None:
         "Updates user with specified cpf."
-        await self.db.users.replace_one({"cpf": cpf}, user.dict())
+        await self._ensure_indexes()
+        with _store_span("update", cpf) as span:
+            partition = self._partition(cpf, span)
+            if not self.migrating:
+                with _db_span("replace_one"):
+                    await partition.replace_one({"cpf": cpf}, user.dict())
+                return
+            # the user may not have been moved here yet, so write it here and
+            # drop the old copy, leaving nothing for the rebalancing to move back
+            with _db_span("replace_one"):
+                await partition.replace_one({"cpf": cpf}, user.dict(), upsert=True)
+            with _db_span("delete_many"):
+                await gather(
+                    *[p.delete_many({"cpf": cpf}) for p in self._other_partitions(cpf)]
+                )
+
+    async def set_password_hash(self, cpf: str, hashed_password: str) -> None:
+        "Replaces the password hash of user with specified cpf."
+        await self._ensure_indexes()
+        with _store_span("set_password_hash", cpf) as span, _db_span("update_one"):
+            update = {"$set": {"hashedPassword": hashed_password}}
+            owner = self._partition(cpf, span)
+            partitions = self.partitions if self.migrating else [owner]
+            await gather(*[p.update_one({"cpf": cpf}, update) for p in partitions])
 
     async def remove(self, cpf: str) -> None:
         "Deletes user with specified cpf."
-        await self.db.users.delete_one({"cpf": cpf})
+        await self._ensure_indexes()
+        with _store_span("remove", cpf) as span, _db_span("delete_one"):
+            owner = self._partition(cpf, span)
+            partitions = self.partitions if self.migrating else [owner]
+            results = await gather(*[p.delete_one({"cpf": cpf}) for p in partitions])
+        self.count_cache.adjust(-sum(r.deleted_count for r in results))
+
+    async def count(self, exact: bool = False) -> int:
+        """Count users.
+
+        Counts come from the collection metadata, unless exact is set, so no
+        collection scan happens. Partitions are counted in parallel, and results
+        are briefly cached.
+        """
+        await self._ensure_indexes()
+        with _store_span("count") as span:
+            count = self.count_cache.get(exact)
+            span.set_attribute("personapi.cache_hit", count is not None)
+            if count is not None:
+                return count
+
+            if exact:
+                with _db_span("count_documents"):
+                    counts = await gather(
+                        *[p.count_documents({}) for p in self.partitions]
+                    )
+            else:
+                with _db_span("estimated_document_count"):
+                    counts = await gather(
+                        *[p.estimated_document_count() for p in self.partitions]
+                    )
+            count = sum(counts)
+            self.count_cache.set(exact, count)
+            span.set_attribute("db.document_count", count)
+            return count
 
     async def get(self, cpf: str) -> Union[UserInDB, None]:
         "Get user with specified cpf. Returns None if not found."
-        if self.simulated_delay_seconds > 0:
-            await sleep(self.simulated_delay_seconds)  # pragma: no cover
-        user = await self.db.users.find_one({"cpf": cpf})
-        if user:
-            return UserInDB(**user)
-        else:
-            return None
+        await self._ensure_indexes()
+        with _store_span("get", cpf) as span:
+            if self.simulated_delay_seconds > 0:
+                await sleep(self.simulated_delay_seconds)  # pragma: no cover
+            with _db_span("find_one"):
+                user = await self._partition(cpf, span).find_one({"cpf": cpf})
+            if not user and self.migrating:
+                with _db_span("find_one"):
+                    found = await gather(
+                        *[p.find_one({"cpf": cpf}) for p in self._other_partitions(cpf)]
+                    )
+                user = next((u for u in found if u), None)
+            span.set_attribute("personapi.found", user is not None)
+            if user:
+                return UserInDB(**user)
+            else:
+                return None
 
     async def get_all(self) -> List[UserInDB]:
         "Get a list of all users."
-        # this would not be wise on a huge db (loads all db in memory at once),
-        # but will suffice here
-        # TODO: fix the hard-coded max here
-        users = await self.db.users.find().to_list(MAX_USERS)
-        return [UserInDB(**u) for u in users]
+        await self._ensure_indexes()
+        with _store_span("get_all") as span:
+            # this would not be wise on a huge db (loads all db in memory at once),
+            # but will suffice here
+            # TODO: fix the hard-coded max here
+            # sorted by cpf, so the order (and what is left out by truncating)
+            # does not depend on the number of partitions, or on which answers
+            # first. Merging partitions sorted that way keeps it sorted.
+            with _db_span("find"):
+                found = await gather(
+                    *[p.find().sort("cpf").to_list(MAX_USERS) for p in self.partitions]
+                )
+            merged = heapq.merge(*found, key=lambda u: u["cpf"])
+            users = list(islice(merged, MAX_USERS))
+            span.set_attribute("db.document_count", len(users))
+            return [UserInDB(**u) for u in users]
@@ -0,0 +1,334 @@
+#!/usr/bin/env python
+"""
+Minimal OpenTelemetry-style tracing for the Person API.
+
+Spans are nested through a context variable, so a span started while another one is
+active becomes its child, across awaits and dependency calls. Finished spans are
+handed to a pluggable exporter. With no exporter configured, tracing is disabled and
+`start_span` returns a shared no-op span, so instrumented code pays only for an
+attribute check.
+
+Incoming W3C `traceparent` headers are honored by `TracingMiddleware`, and the
+request span is reported back on the `traceresponse` header.
+"""
+
+import functools
+import hashlib
+import hmac
+import importlib
+import inspect
+import json
+import re
+import secrets
+import time
+from contextvars import ContextVar
+from typing import Any, Dict, List, Optional, Tuple
+
+_traceparent_re = re.compile(r"^00-([0-9a-f]{32})-([0-9a-f]{16})-([0-9a-f]{2})$")
+_invalid_trace_id = "0" * 32
+_invalid_span_id = "0" * 16
+
+
+class Span:
+    "A timed operation, part of a trace."
+
+    is_recording = True
+
+    def __init__(
+        self,
+        tracer: "Tracer",
+        name: str,
+        trace_id: str,
+        parent_id: Optional[str] = None,
+        attributes: Optional[Dict[str, Any]] = None,
+    ):
+        self.tracer = tracer
+        self.name = name
+        self.trace_id = trace_id
+        self.span_id = secrets.token_hex(8)
+        self.parent_id = parent_id
+        self.attributes: Dict[str, Any] = dict(attributes or {})
+        self.status = "OK"
+        self.start_time_ns = time.time_ns()
+        self.end_time_ns: Optional[int] = None
+        self._token = None
+
+    def set_attribute(self, key: str, value: Any) -> None:
+        self.attributes[key] = value
+
+    def record_exception(self, exc: BaseException) -> None:
+        # only the type: messages may carry personal data, like CPFs
+        self.status = "ERROR"
+        self.attributes["exception.type"] = type(exc).__name__
+
+    @property
+    def duration_ms(self) -> Optional[float]:
+        if self.end_time_ns is None:
+            return None
+        return (self.end_time_ns - self.start_time_ns) / 1e6
+
+    @property
+    def traceparent(self) -> str:
+        "This span as a W3C traceparent header value, for propagating downstream."
+        return "00-%s-%s-01" % (self.trace_id, self.span_id)
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "name": self.name,
+            "trace_id": self.trace_id,
+            "span_id": self.span_id,
+            "parent_id": self.parent_id,
+            "start_time_ns": self.start_time_ns,
+            "end_time_ns": self.end_time_ns,
+            "duration_ms": self.duration_ms,
+            "status": self.status,
+            "attributes": self.attributes,
+        }
+
+    def __enter__(self) -> "Span":
+        self._token = _current_span.set(self)
+        return self
+
+    def __exit__(self, exc_type, exc, tb) -> None:
+        if exc is not None:
+            self.record_exception(exc)
+        self.end_time_ns = time.time_ns()
+        _current_span.reset(self._token)
+        self.tracer.export(self)
+
+
+class NonRecordingSpan:
+    "The span used when tracing is disabled. Does nothing."
+
+    is_recording = False
+    traceparent = None
+
+    def set_attribute(self, key: str, value: Any) -> None:
+        pass
+
+    def record_exception(self, exc: BaseException) -> None:
+        pass
+
+    def __enter__(self) -> "NonRecordingSpan":
+        return self
+
+    def __exit__(self, exc_type, exc, tb) -> None:
+        pass
+
+
+_non_recording_span = NonRecordingSpan()
+_current_span: ContextVar[Optional[Span]] = ContextVar("current_span", default=None)
+
+
+class InMemorySpanExporter:
+    "Keeps finished spans in a list. Meant for tests."
+
+    def __init__(self):
+        self.spans: List[Span] = []
+
+    def export(self, span: Span) -> None:
+        self.spans.append(span)
+
+    def get_finished_spans(self) -> List[Span]:
+        return list(self.spans)
+
+    def clear(self) -> None:
+        self.spans.clear()
+
+
+class ConsoleSpanExporter:
+    "Prints each finished span as a JSON line on stdout."
+
+    def export(self, span: Span) -> None:
+        print(json.dumps(span.to_dict(), default=str), flush=True)
+
+
+# selectable by name from settings. InMemorySpanExporter is not among them, as
+# it would keep every span of a long running pod: tests set it directly
+exporters = {
+    "console": ConsoleSpanExporter,
+}
+
+
+class Tracer:
+    def __init__(self):
+        self.exporter = None
+        # random until configured, so hashes are safe but only match in-process
+        self.hash_key = secrets.token_bytes(32)
+
+    @property
+    def enabled(self) -> bool:
+        return self.exporter is not None
+
+    def set_exporter(self, exporter) -> None:
+        "Sets the object receiving finished spans. None disables tracing."
+        self.exporter = exporter
+
+    def set_hash_secret(self, secret: str) -> None:
+        """Derives the key used by `hash_cpf` from a deployment secret.
+
+        Pods sharing the secret produce the same hashes, so traces can be matched
+        across them. The secret itself is never used as the key.
+        """
+        self.hash_key = hmac.new(
+            secret.encode(), b"personapi tracing cpf hash", hashlib.sha256
+        ).digest()
+
+    def configure(self, exporter_name: str, hash_secret: Optional[str] = None) -> None:
+        """Sets the exporter by name, as given in settings.
+
+        Besides the names in `exporters`, accepts "module:attribute" pointing to an
+        exporter class or factory. An empty name disables tracing.
+        """
+        if hash_secret:
+            self.set_hash_secret(hash_secret)
+        if not exporter_name:
+            self.set_exporter(None)
+        elif exporter_name in exporters:
+            self.set_exporter(exporters[exporter_name]())
+        elif ":" in exporter_name:
+            module_name, attribute = exporter_name.split(":", 1)
+            factory = getattr(importlib.import_module(module_name), attribute)
+            self.set_exporter(factory())
+        else:
+            raise ValueError("Unknown tracing exporter: %s" % exporter_name)
+
+    def start_span(
+        self,
+        name: str,
+        attributes: Optional[Dict[str, Any]] = None,
+        traceparent: Optional[str] = None,
+    ):
+        """Returns a span, to be used as a context manager.
+
+        The span is a child of the currently active span, or of the remote span in
+        `traceparent`, if given and valid. Otherwise it starts a new trace.
+        """
+        if self.exporter is None:
+            return _non_recording_span
+        remote = parse_traceparent(traceparent) if traceparent else None
+        if remote:
+            trace_id, parent_id = remote
+        else:
+            parent = _current_span.get()
+            if parent is not None:
+                trace_id, parent_id = parent.trace_id, parent.span_id
+            else:
+                trace_id, parent_id = secrets.token_hex(16), None
+        return Span(self, name, trace_id, parent_id, attributes)
+
+    def export(self, span: Span) -> None:
+        exporter = self.exporter
+        if exporter is not None:
+            exporter.export(span)
+
+
+tracer = Tracer()
+
+
+def get_current_span():
+    "Returns the active span, or a no-op one if there is none."
+    return _current_span.get() or _non_recording_span
+
+
+def parse_traceparent(value: str) -> Optional[Tuple[str, str]]:
+    "Returns (trace_id, parent_id) from a W3C traceparent value, or None if invalid."
+    match = _traceparent_re.match(value.strip().lower())
+    if not match:
+        return None
+    trace_id, parent_id, _ = match.groups()
+    if trace_id == _invalid_trace_id or parent_id == _invalid_span_id:
+        return None
+    return trace_id, parent_id
+
+
+def hash_cpf(cpf: str) -> str:
+    """An identifier for a CPF, so it can go in span attributes.
+
+    A plain hash would not do: there are few enough CPFs to hash them all and look
+    the result up. This is a keyed HMAC instead, which can only be reversed by
+    someone holding the key (see `Tracer.set_hash_secret`).
+    """
+    return hmac.new(tracer.hash_key, cpf.encode(), hashlib.sha256).hexdigest()[:16]
+
+
+def traced(name: Optional[str] = None):
+    """Decorator wrapping each call of a function in a span.
+
+    Works with both sync and async functions, and keeps the signature visible to
+    FastAPI, so it can be used on dependencies.
+    """
+
+    def decorator(func):
+        span_name = name or func.__qualname__
+
+        if inspect.iscoroutinefunction(func):
+
+            @functools.wraps(func)
+            async def async_wrapper(*args, **kwargs):
+                if tracer.exporter is None:
+                    return await func(*args, **kwargs)
+                with tracer.start_span(span_name):
+                    return await func(*args, **kwargs)
+
+            return async_wrapper
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            if tracer.exporter is None:
+                return func(*args, **kwargs)
+            with tracer.start_span(span_name):
+                return func(*args, **kwargs)
+
+        return wrapper
+
+    return decorator
+
+
+class TracingMiddleware:
+    """ASGI middleware starting a span for each HTTP request.
+
+    The span is named after the route template (like "GET /users/{cpf}"), never the
+    actual path, which would carry CPFs into the traces. When tracing is disabled,
+    requests are passed through untouched.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or tracer.exporter is None:
+            await self.app(scope, receive, send)
+            return
+
+        traceparent = None
+        for key, value in scope.get("headers", []):
+            if key == b"traceparent":
+                traceparent = value.decode("latin-1")
+                break
+
+        # the route is only known once routing has run, renamed below
+        span = tracer.start_span(
+            scope["method"], {"http.method": scope["method"]}, traceparent=traceparent
+        )
+
+        def name_after_route():
+            route = scope.get("route")
+            if route is not None and "http.route" not in span.attributes:
+                span.name = "%s %s" % (scope["method"], route.path)
+                span.set_attribute("http.route", route.path)
+
+        async def send_with_trace(message):
+            if message["type"] == "http.response.start":
+                name_after_route()
+                span.set_attribute("http.status_code", message["status"])
+                headers = list(message.get("headers", []))
+                headers.append((b"traceresponse", span.traceparent.encode()))
+                message = dict(message, headers=headers)
+            await send(message)
+
+        with span:
+            try:
+                await self.app(scope, receive, send_with_trace)
+            finally:
+                name_after_route()
@@ -2,17 +2,31 @@
 """
 Supporting functions and classes shared by other modules in the Person API package.
 """
-from typing import Dict
+
+from typing import Dict, List
 
 from pydantic import BaseSettings
 
 
 class Settings(BaseSettings):
     db_conn_str: str = "mongodb://localhost:27017/"
+    # one connection string per partition, as a JSON list. Overrides db_conn_str.
+    # Partitions are known by position: only append to it, then rebalance.
+    db_partitions: List[str] = []
+    db_partitions_migrating: bool = False  # set while rebalancing
     simulated_delay_seconds: int = 0
+    count_cache_seconds: float = 5
     auth_token_algorithm: str = "HS256"
     auth_token_expiration_in_minutes: int = 15
     auth_token_base_secret: str
+    password_hash_scheme: str = "bcrypt"  # or argon2, if argon2-cffi is installed
+    password_hash_cost: int = 12
+    password_hash_argon2_memory_cost: int = 65536  # in KiB
+    readiness_cache_seconds: float = 2
+    readiness_ping_timeout_seconds: float = 1
+    readiness_max_pool_saturation: float = 1  # fraction of the pool in use
+    readiness_max_event_loop_lag_seconds: float = 0.5
+    tracing_exporter: str = ""  # console or module:attribute. Empty disables
 
     class Config:
         env_prefix = "personapi_"
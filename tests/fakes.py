@@ -0,0 +1,137 @@
+"""
+In-memory stand-ins for MongoDB collections, supporting only what the Person API
+uses, and only equality filters. Allow testing partitioning without databases.
+"""
+
+import copy
+from itertools import count
+from types import SimpleNamespace
+
+from pymongo.errors import DuplicateKeyError
+
+_ids = count()
+
+
+def _matches(doc: dict, filter: dict) -> bool:
+    return all(doc.get(key) == value for key, value in filter.items())
+
+
+class InMemoryCollection:
+    "Synchronous, like pymongo collections."
+
+    def __init__(self, docs=()):
+        self.docs = []
+        self.unique_keys = set()
+        for doc in docs:
+            self.insert_one(doc)
+
+    def create_index(self, key, unique=False):
+        if unique:
+            self.unique_keys.add(key)
+        return key + "_1"
+
+    def _check_unique(self, doc, ignore=None):
+        for key in self.unique_keys:
+            if any(d[key] == doc.get(key) for d in self.docs if d is not ignore):
+                raise DuplicateKeyError("duplicate key: %s" % key)
+
+    def find(self, filter=None):
+        return [copy.deepcopy(d) for d in self.docs if _matches(d, filter or {})]
+
+    def find_one(self, filter):
+        return next(iter(self.find(filter)), None)
+
+    def insert_one(self, doc):
+        self._check_unique(doc)
+        inserted_id = next(_ids)
+        self.docs.append(dict(copy.deepcopy(doc), _id=inserted_id))
+        return SimpleNamespace(inserted_id=inserted_id)
+
+    def replace_one(self, filter, doc, upsert=False):
+        for i, existing in enumerate(self.docs):
+            if _matches(existing, filter):
+                self._check_unique(doc, ignore=existing)
+                self.docs[i] = dict(copy.deepcopy(doc), _id=existing["_id"])
+                return
+        if upsert:
+            self.insert_one(doc)
+
+    def update_one(self, filter, update, upsert=False):
+        for existing in self.docs:
+            if _matches(existing, filter):
+                existing.update(copy.deepcopy(update.get("$set", {})))
+                return SimpleNamespace(upserted_id=None)
+        upserted_id = None
+        if upsert:
+            doc = dict(filter, **update.get("$setOnInsert", {}))
+            upserted_id = self.insert_one(doc).inserted_id
+        return SimpleNamespace(upserted_id=upserted_id)
+
+    def delete_one(self, filter):
+        for i, existing in enumerate(self.docs):
+            if _matches(existing, filter):
+                del self.docs[i]
+                return SimpleNamespace(deleted_count=1)
+        return SimpleNamespace(deleted_count=0)
+
+    def delete_many(self, filter):
+        before = len(self.docs)
+        self.docs = [d for d in self.docs if not _matches(d, filter)]
+        return SimpleNamespace(deleted_count=before - len(self.docs))
+
+    def count_documents(self, filter):
+        return len(self.find(filter))
+
+
+class _AsyncCursor:
+    def __init__(self, docs):
+        self.docs = docs
+
+    def sort(self, key):
+        return _AsyncCursor(sorted(self.docs, key=lambda d: d[key]))
+
+    async def to_list(self, length):
+        return self.docs[:length]
+
+
+class _AsyncDatabase:
+    async def command(self, name):
+        return {"ok": 1}
+
+
+class AsyncInMemoryCollection:
+    "Asynchronous, like motor collections. Keeps its data on `sync`."
+
+    def __init__(self, docs=()):
+        self.sync = InMemoryCollection(docs)
+        self.database = _AsyncDatabase()
+
+    async def create_index(self, key, unique=False):
+        return self.sync.create_index(key, unique)
+
+    def find(self, filter=None):
+        return _AsyncCursor(self.sync.find(filter))
+
+    async def find_one(self, filter):
+        return self.sync.find_one(filter)
+
+    async def insert_one(self, doc):
+        self.sync.insert_one(doc)
+
+    async def replace_one(self, filter, doc, upsert=False):
+        self.sync.replace_one(filter, doc, upsert)
+
+    async def update_one(self, filter, update, upsert=False):
+        self.sync.update_one(filter, update, upsert)
+
+    async def delete_one(self, filter):
+        return self.sync.delete_one(filter)
+
+    async def delete_many(self, filter):
+        return self.sync.delete_many(filter)
+
+    async def count_documents(self, filter):
+        return self.sync.count_documents(filter)
+
+    async def estimated_document_count(self):
+        return len(self.sync.docs)
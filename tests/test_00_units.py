@@ -1,7 +1,30 @@
+import asyncio
 import random
 from datetime import date, timedelta
 
-from personapi.store import User
+import pytest
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+from loadtest.data import Dataset, ZipfSampler, cpf_from_number, fresh_cpf
+from loadtest.slo import SLO, Metrics, build_report, check_slo, exit_code
+from personapi.api import app
+from personapi.auth import (
+    HASH_COST_BOUNDS,
+    AuthProvider,
+    PasswordHasher,
+    calibrate_hash_cost,
+)
+from personapi.health import ReadinessChecker
+from personapi.store import CountCache, User, UserInDB
+from personapi.tracing import (
+    InMemorySpanExporter,
+    Tracer,
+    TracingMiddleware,
+    hash_cpf,
+    parse_traceparent,
+    traced,
+    tracer,
+)
 from personapi.utils import SingletonMeta
 from pydantic import ValidationError
 from pytest import raises
@@ -9,6 +32,14 @@ from pytest import raises
 from .testdata import duplicate_user, new_user, nonexistent_user, users
 
 
+@pytest.fixture
+def fresh_singletons():
+    "Lets each test build its own singletons, like AuthProvider, with any arguments."
+    SingletonMeta._instances.clear()
+    yield
+    SingletonMeta._instances.clear()
+
+
 def test_singleton():
     class TestSingleton(metaclass=SingletonMeta):
         def __init__(self):
@@ -91,3 +122,311 @@ def test_invalid_cpf():
         # print(item)
         with raises(ValidationError):
             User(**invalid_user)
+
+
+def test_password_hasher():
+    hasher = PasswordHasher(cost=4)
+    hashed_password = hasher.get_hash("secret")
+    assert hasher.verify("secret", hashed_password)
+    assert not hasher.verify("wrong", hashed_password)
+    assert not hasher.needs_update(hashed_password)
+
+
+def test_password_hasher_needs_update_on_cost_change():
+    hashed_password = PasswordHasher(cost=4).get_hash("secret")
+    hasher = PasswordHasher(cost=5)
+    # old hashes must still verify, so they can be upgraded on login
+    assert hasher.verify("secret", hashed_password)
+    assert hasher.needs_update(hashed_password)
+
+
+def test_password_hasher_invalid_settings():
+    with raises(ValueError):
+        PasswordHasher(scheme="md5_crypt")
+    with raises(ValueError):
+        PasswordHasher(cost=3)
+
+
+class FakeRehashStore:
+    def __init__(self, hashed_password, fail=False):
+        self.user = UserInDB(**new_user, isAdmin=True, hashedPassword=hashed_password)
+        self.fail = fail
+
+    async def get(self, cpf):
+        return self.user
+
+    async def set_password_hash(self, cpf, hashed_password):
+        if self.fail:
+            raise ConnectionError("db went away")
+        self.user.hashedPassword = hashed_password
+
+
+def test_login_rehashes_outdated_password(fresh_singletons):
+    store = FakeRehashStore(PasswordHasher(cost=4).get_hash("secret"))
+    hasher = PasswordHasher(cost=5)
+    auth = AuthProvider("secret", "HS256", 15, store, hasher)
+    token = asyncio.run(auth.auth_user("x", "secret"))
+    assert token.access_token
+    assert not hasher.needs_update(store.user.hashedPassword)
+
+
+def test_login_survives_rehash_failure(fresh_singletons):
+    outdated_hash = PasswordHasher(cost=4).get_hash("secret")
+    store = FakeRehashStore(outdated_hash, fail=True)
+    auth = AuthProvider("secret", "HS256", 15, store, PasswordHasher(cost=5))
+    token = asyncio.run(auth.auth_user("x", "secret"))
+    assert token.access_token
+    assert store.user.hashedPassword == outdated_hash
+
+
+def test_calibrate_hash_cost():
+    min_cost = HASH_COST_BOUNDS["bcrypt"][0]
+    # nothing is that fast, so we get the minimum
+    assert calibrate_hash_cost(0, samples=1) == min_cost
+    # bcrypt at the minimum cost takes a few ms, so there is room to go up
+    low = calibrate_hash_cost(0.005, samples=1)
+    high = calibrate_hash_cost(0.2, samples=1)
+    assert min_cost <= low <= high
+    assert high > min_cost
+
+
+@pytest.fixture
+def span_exporter():
+    exporter = InMemorySpanExporter()
+    tracer.set_exporter(exporter)
+    yield exporter
+    tracer.set_exporter(None)
+
+
+def test_tracing_disabled():
+    assert not tracer.enabled
+    with tracer.start_span("noop") as span:
+        span.set_attribute("key", "value")
+    assert not span.is_recording
+
+
+def test_tracing_nested_spans(span_exporter):
+    @traced()
+    async def child():
+        return 42
+
+    async def parent():
+        with tracer.start_span("parent", {"key": "value"}):
+            return await child()
+
+    assert asyncio.run(parent()) == 42
+    child_span, parent_span = span_exporter.get_finished_spans()
+    assert child_span.name.endswith("child")
+    assert child_span.parent_id == parent_span.span_id
+    assert child_span.trace_id == parent_span.trace_id
+    assert parent_span.parent_id is None
+    assert parent_span.attributes == {"key": "value"}
+
+
+def test_tracing_records_exception(span_exporter):
+    with raises(ValueError):
+        with tracer.start_span("failing"):
+            raise ValueError("boom")
+    (span,) = span_exporter.get_finished_spans()
+    assert span.status == "ERROR"
+    assert span.attributes["exception.type"] == "ValueError"
+
+
+def test_tracer_configure():
+    tracing = Tracer()
+    tracing.configure("console")
+    assert tracing.enabled
+    tracing.configure("")
+    assert not tracing.enabled
+    # would keep all spans forever on a pod
+    with raises(ValueError):
+        tracing.configure("memory")
+
+
+def test_hash_cpf_is_keyed():
+    cpf = new_user["cpf"]
+    first = Tracer()
+    first.set_hash_secret("secret")
+    second = Tracer()
+    second.set_hash_secret("secret")
+    assert first.hash_key == second.hash_key
+    second.set_hash_secret("other secret")
+    assert first.hash_key != second.hash_key
+
+    assert hash_cpf(cpf) == hash_cpf(cpf)
+    assert hash_cpf(cpf) != hash_cpf(new_user["cpf"].replace("4", "5"))
+
+
+def test_parse_traceparent():
+    trace_id = "4bf92f3577b34da6a3ce929d0e0e4736"
+    parent_id = "00f067aa0ba902b7"
+    assert parse_traceparent("00-%s-%s-01" % (trace_id, parent_id)) == (
+        trace_id,
+        parent_id,
+    )
+    assert parse_traceparent("00-%s-%s-01" % ("0" * 32, parent_id)) is None
+    assert parse_traceparent("garbage") is None
+
+
+def test_tracing_middleware_propagates_traceparent(span_exporter):
+    app = FastAPI()
+    app.add_middleware(TracingMiddleware)
+
+    @app.get("/ping/{cpf}")
+    @traced()
+    async def ping(cpf: str):
+        return {}
+
+    trace_id = "4bf92f3577b34da6a3ce929d0e0e4736"
+    response = TestClient(app).get(
+        "/ping/609.350.354-27",
+        headers={"traceparent": "00-%s-00f067aa0ba902b7-01" % trace_id},
+    )
+    handler_span, request_span = span_exporter.get_finished_spans()
+    assert request_span.trace_id == trace_id
+    assert request_span.parent_id == "00f067aa0ba902b7"
+    assert request_span.attributes["http.status_code"] == 200
+    # named after the route, no CPF in the span
+    assert request_span.name == "GET /ping/{cpf}"
+    assert request_span.attributes["http.route"] == "/ping/{cpf}"
+    assert "609.350.354-27" not in repr(request_span.to_dict())
+    assert handler_span.parent_id == request_span.span_id
+    assert response.headers["traceresponse"] == request_span.traceparent
+
+
+def test_healthz():
+    response = TestClient(app).get("/healthz")
+    assert response.status_code == 200
+    assert response.json() == {"status": "ok"}
+
+
+class FakePingStore:
+    def __init__(self, fail=False):
+        self.fail = fail
+        self.pings = 0
+
+    async def ping(self):
+        self.pings += 1
+        await asyncio.sleep(0.01)
+        if self.fail:
+            raise ConnectionError("no db")
+
+    def pool_saturation(self):
+        return 0.5
+
+
+def new_readiness_checker(store, cache_seconds=60, max_pool_saturation=1):
+    return ReadinessChecker(store, cache_seconds, 1, max_pool_saturation, 1)
+
+
+def test_readiness_cached_and_shared(fresh_singletons):
+    store = FakePingStore()
+    checker = new_readiness_checker(store)
+
+    async def probes():
+        results = await asyncio.gather(*[checker.check() for _ in range(10)])
+        results.append(await checker.check())
+        return results
+
+    results = asyncio.run(probes())
+    assert store.pings == 1
+    assert all(r.ready and r.mongodb for r in results)
+    assert results[0].pool_saturation == 0.5
+
+
+def test_readiness_cache_expires(fresh_singletons):
+    store = FakePingStore()
+    checker = new_readiness_checker(store, cache_seconds=0)
+
+    async def probes():
+        await checker.check()
+        await checker.check()
+
+    asyncio.run(probes())
+    assert store.pings == 2
+
+
+def test_not_ready_on_ping_failure(fresh_singletons):
+    readiness = asyncio.run(new_readiness_checker(FakePingStore(fail=True)).check())
+    assert not readiness.ready
+    assert not readiness.mongodb
+    assert not readiness.load_shedding
+    # no error details to the public
+    assert readiness.reasons == ["MongoDB ping failed"]
+
+
+def test_not_ready_when_shedding_load(fresh_singletons):
+    checker = new_readiness_checker(FakePingStore(), max_pool_saturation=0.5)
+    readiness = asyncio.run(checker.check())
+    assert not readiness.ready
+    assert readiness.load_shedding
+    assert readiness.reasons == ["MongoDB connection pool saturated"]
+
+
+def test_count_cache():
+    cache = CountCache(ttl_seconds=60)
+    assert cache.get(False) is None
+    cache.set(False, 10)
+    cache.set(True, 11)
+    assert cache.get(False) == 10
+
+    cache.adjust(+1)
+    assert cache.get(False) == 11
+    assert cache.get(True) == 12
+    cache.adjust(-20)
+    assert cache.get(True) == 0
+
+
+def test_count_cache_expires():
+    cache = CountCache(ttl_seconds=0)
+    cache.set(False, 10)
+    assert cache.get(False) is None
+
+
+def test_loadtest_cpfs_are_valid():
+    assert cpf_from_number(609350354) == "609.350.354-27"
+    assert cpf_from_number(111111111) is None
+    rng = random.Random(1)
+    for _ in range(100):
+        cpf = fresh_cpf(rng)
+        assert User(**dict(new_user, cpf=cpf)).cpf == cpf
+
+
+def test_loadtest_dataset_is_reproducible():
+    dataset = Dataset(200, seed=7, admins=2)
+    assert dataset.people == Dataset(200, seed=7).people
+    assert dataset.people != Dataset(200, seed=8).people
+    assert len({p["cpf"] for p in dataset.people}) == 200
+    assert dataset.admin_cpfs == [p["cpf"] for p in dataset.people[:2]]
+    assert len(dataset.regular_people) == 198
+    assert not set(dataset.admin_cpfs) & {p["cpf"] for p in dataset.regular_people}
+    for person in dataset.people:
+        User(**person)
+
+
+def test_zipf_sampler():
+    sampler = ZipfSampler(100, 1.2, random.Random(1))
+    counts = [0] * 100
+    for _ in range(10000):
+        counts[sampler.sample()] += 1
+    assert counts[0] > counts[1] > counts[10]
+    assert counts[0] > 10000 / 100 * 5
+
+
+def test_check_slo():
+    metrics = Metrics(requests=1000, failures=20, rps=50, p95_ms=150, p99_ms=400)
+    assert metrics.error_rate == 0.02
+    assert check_slo(metrics, SLO()) == []
+    assert check_slo(metrics, SLO(min_rps=40, max_p95_ms=200, max_p99_ms=400)) == []
+    violations = check_slo(
+        metrics, SLO(min_rps=60, max_p95_ms=100, max_p99_ms=300, max_error_rate=0.01)
+    )
+    assert len(violations) == 4
+    assert check_slo(Metrics(requests=0, failures=0, rps=0, p95_ms=0, p99_ms=0), SLO())
+
+
+def test_slo_exit_code():
+    # a few errors within the objectives must not fail the run
+    metrics = Metrics(requests=1000, failures=2, rps=50, p95_ms=150, p99_ms=400)
+    assert exit_code(build_report("p", metrics, SLO(max_error_rate=0.01))) == 0
+    assert exit_code(build_report("p", metrics, SLO(max_error_rate=0.001))) == 1
@@ -1,4 +1,5 @@
 import copy
+import os
 from time import sleep
 
 import pytest
@@ -10,6 +11,8 @@ from requests.models import Response
 from personapi.api import app, get_settings, token_url
 from personapi.utils import Settings
 from personapi.auth import PasswordHasher, Token
+from personapi.startup import measure_time_to_first_request
+from personapi.tracing import InMemorySpanExporter, tracer
 from pymongo import MongoClient
 
 from .testdata import (
@@ -133,6 +136,23 @@ def test_invalid_credentials(testclient: TestClient):
     assert response.status_code == status.HTTP_401_UNAUTHORIZED
 
 
+def test_login_rehashes_outdated_password(testclient: TestClient, testdb_conn_str):
+    user = users[test_auth_user_index]
+    db_users = MongoClient(testdb_conn_str)["people"].users
+    outdated_hash = PasswordHasher(cost=4).get_hash(test_auth_user_password)
+    db_users.update_one(
+        {"cpf": user["cpf"]}, {"$set": {"hashedPassword": outdated_hash}}
+    )
+
+    response = http_login_request(testclient, user["cpf"], test_auth_user_password)
+    assert response.status_code == status.HTTP_200_OK
+
+    new_hash = db_users.find_one({"cpf": user["cpf"]})["hashedPassword"]
+    assert new_hash != outdated_hash
+    assert not PasswordHasher().needs_update(new_hash)
+    assert PasswordHasher().verify(test_auth_user_password, new_hash)
+
+
 def test_get_user_me(testclient: TestClient, testauth_header: dict):
     user = users[0]
     response = testclient.get("/users/me", headers=testauth_header)
@@ -140,12 +160,65 @@ def test_get_user_me(testclient: TestClient, testauth_header: dict):
     assert response.json() == user
 
 
+def test_get_user_me_traced(testclient: TestClient, testauth_header: dict):
+    exporter = InMemorySpanExporter()
+    tracer.set_exporter(exporter)
+    try:
+        response = testclient.get("/users/me", headers=testauth_header)
+    finally:
+        tracer.set_exporter(None)
+    assert response.status_code == status.HTTP_200_OK
+
+    spans = {span.name: span for span in exporter.get_finished_spans()}
+    request_span = spans["GET /users/me"]
+    assert request_span.attributes["http.route"] == "/users/me"
+    assert spans["validate_token"].parent_id == request_span.span_id
+    auth_span = spans["AuthProvider.validate_token"]
+    assert auth_span.parent_id == spans["validate_token"].span_id
+    assert spans["jwt.decode"].parent_id == auth_span.span_id
+    assert spans["UserStore.get"].parent_id == auth_span.span_id
+    assert spans["mongodb.find_one"].parent_id == spans["UserStore.get"].span_id
+    assert "personapi.cpf_hash" in spans["UserStore.get"].attributes
+
+
+def test_readyz(testclient: TestClient):
+    response = testclient.get("/readyz")
+    assert response.status_code == status.HTTP_200_OK
+    readiness = response.json()
+    assert readiness["ready"]
+    assert readiness["mongodb"]
+    assert not readiness["load_shedding"]
+
+
 def test_get_users(testclient):
     response = testclient.get("/users/")
     assert response.status_code == status.HTTP_200_OK
     assert len(response.json()) == len(users)
 
 
+def test_get_users_total_count(testclient):
+    response = testclient.get("/users/")
+    assert response.headers["X-Total-Count"] == str(len(users))
+
+    response = testclient.get("/users/", params={"exact_count": True})
+    assert response.headers["X-Total-Count"] == str(len(users))
+
+
+def test_head_users_count(testclient):
+    response = testclient.head("/users")
+    assert response.status_code == status.HTTP_200_OK
+    assert response.headers["X-Total-Count"] == str(len(users))
+    assert response.content == b""
+
+
+def test_users_count_follows_writes(testclient):
+    count = int(testclient.head("/users").headers["X-Total-Count"])
+    testclient.post("/users", json=new_user)
+    assert testclient.head("/users").headers["X-Total-Count"] == str(count + 1)
+    testclient.delete("/users/" + new_user["cpf"])
+    assert testclient.head("/users").headers["X-Total-Count"] == str(count)
+
+
 def test_get_user(testclient):
     user = users[0]
     response = testclient.get("/users/" + user["cpf"])
@@ -211,3 +284,12 @@ def test_user_get_nonexistent(testclient):
 def test_user_delete_nonexistent(testclient):
     response = testclient.delete("/users/" + nonexistent_user["cpf"])
     assert response.status_code == status.HTTP_404_NOT_FOUND
+
+
+def test_time_to_first_store_request(testdb_primed):
+    # loads motor and pymongo, deferred on import, and goes to the database
+    budget_ms = float(os.environ.get("PERSONAPI_TEST_FIRST_REQUEST_BUDGET_MS", 3000))
+    seconds = measure_time_to_first_request(
+        "/users", env={"PERSONAPI_DB_CONN_STR": testdb_primed}
+    )
+    assert seconds * 1000 < budget_ms
@@ -0,0 +1,36 @@
+import os
+
+from personapi.startup import (
+    eagerly_loaded_modules,
+    measure_import_time,
+    measure_lazy_import_time,
+    measure_time_to_first_request,
+)
+
+# generous on purpose, to catch regressions (like a heavy dependency loaded eagerly)
+# without failing on slow CI runners. Can be tightened through the environment.
+import_budget_ms = float(os.environ.get("PERSONAPI_TEST_IMPORT_BUDGET_MS", 1000))
+lazy_import_budget_ms = float(
+    os.environ.get("PERSONAPI_TEST_LAZY_IMPORT_BUDGET_MS", 1500)
+)
+first_request_budget_ms = float(
+    os.environ.get("PERSONAPI_TEST_FIRST_REQUEST_BUDGET_MS", 3000)
+)
+
+
+def test_heavy_dependencies_are_lazy():
+    assert eagerly_loaded_modules() == []
+
+
+def test_import_time_budget():
+    assert measure_import_time() * 1000 < import_budget_ms
+
+
+def test_lazy_import_time_budget():
+    # the cost moved out of the import, paid by the first requests using the store
+    # and auth. Time to first request using the store is in the integration tests.
+    assert measure_lazy_import_time() * 1000 < lazy_import_budget_ms
+
+
+def test_time_to_first_request_budget():
+    assert measure_time_to_first_request() * 1000 < first_request_budget_ms
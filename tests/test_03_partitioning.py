@@ -0,0 +1,221 @@
+import asyncio
+
+from loadtest.data import Dataset
+from personapi.partitioning import partition_index
+from personapi.rebalance import rebalance
+from personapi.store import MAX_USERS, User, UserStore
+from pytest import raises
+
+from .fakes import AsyncInMemoryCollection, InMemoryCollection
+from .testdata import new_user
+
+people = Dataset(300, seed=3).people
+
+
+def partitioned_store(partitions=3, migrating=False):
+    collections = [AsyncInMemoryCollection() for _ in range(partitions)]
+    return UserStore.from_collections(collections, migrating=migrating), collections
+
+
+def add_all(store, people):
+    async def add():
+        for person in people:
+            await store.add(User(**person))
+
+    asyncio.run(add())
+
+
+def test_partition_index_is_stable():
+    cpf = new_user["cpf"]
+    assert partition_index(cpf, 4) == partition_index(cpf, 4)
+    assert partition_index(cpf, 4) == partition_index(cpf.replace(".", ""), 4)
+    assert partition_index(cpf, 1) == 0
+
+
+def test_partition_index_spreads_users():
+    counts = [0] * 3
+    for person in people:
+        counts[partition_index(person["cpf"], 3)] += 1
+    assert all(count > len(people) / 3 * 0.7 for count in counts)
+
+
+def test_adding_partition_only_moves_users_to_it():
+    moved = 0
+    for person in people:
+        before = partition_index(person["cpf"], 3)
+        after = partition_index(person["cpf"], 4)
+        if before != after:
+            assert after == 3
+            moved += 1
+    assert 0 < moved < len(people) / 2
+
+
+def test_single_user_operations_touch_one_partition():
+    store, collections = partitioned_store()
+    cpf = new_user["cpf"]
+    owner = collections[partition_index(cpf, 3)]
+
+    asyncio.run(store.add(User(**new_user)))
+    assert [len(c.sync.docs) for c in collections].count(1) == 1
+    assert owner.sync.find_one({"cpf": cpf})
+
+    user = asyncio.run(store.get(cpf))
+    assert user.cpf == cpf
+
+    asyncio.run(store.update(cpf, User(**dict(new_user, lastName="Changed"))))
+    assert owner.sync.find_one({"cpf": cpf})["lastName"] == "Changed"
+
+    asyncio.run(store.set_password_hash(cpf, "hash"))
+    assert owner.sync.find_one({"cpf": cpf})["hashedPassword"] == "hash"
+
+    asyncio.run(store.remove(cpf))
+    assert asyncio.run(store.get(cpf)) is None
+    assert all(not c.sync.docs for c in collections)
+
+
+def test_get_all_and_count_merge_partitions():
+    store, collections = partitioned_store()
+    add_all(store, people[:50])
+    users = asyncio.run(store.get_all())
+    assert sorted(u.cpf for u in users) == sorted(p["cpf"] for p in people[:50])
+    assert asyncio.run(store.count()) == 50
+    assert asyncio.run(store.count(exact=True)) == 50
+
+
+def test_get_all_truncates_merged_list():
+    store, collections = partitioned_store()
+    add_all(store, people[: MAX_USERS + 50])
+    cpfs = [u.cpf for u in asyncio.run(store.get_all())]
+    assert cpfs == sorted(p["cpf"] for p in people[: MAX_USERS + 50])[:MAX_USERS]
+
+
+def test_get_all_order_does_not_depend_on_partitions():
+    lists = []
+    for partitions in (1, 3):
+        store, _ = partitioned_store(partitions)
+        add_all(store, people[:50])
+        lists.append([u.cpf for u in asyncio.run(store.get_all())])
+    assert lists[0] == lists[1] == sorted(p["cpf"] for p in people[:50])
+
+
+def test_store_indexes_cpf_on_every_partition():
+    store, collections = partitioned_store()
+    asyncio.run(store.count())
+    assert all(c.sync.unique_keys == {"cpf"} for c in collections)
+
+
+def test_ping_all_partitions():
+    store, _ = partitioned_store()
+    asyncio.run(store.ping())
+    assert store.pool_saturation() == 0.0
+
+
+def test_migrating_store_finds_and_fixes_misplaced_users():
+    store, collections = partitioned_store(migrating=True)
+    cpf = new_user["cpf"]
+    owner_index = partition_index(cpf, 3)
+    old = collections[(owner_index + 1) % 3]
+    # as if it was added before the current partitions
+    old.sync.insert_one(User(**new_user).dict())
+
+    assert asyncio.run(store.get(cpf)).cpf == cpf
+
+    asyncio.run(store.set_password_hash(cpf, "hash"))
+    assert old.sync.find_one({"cpf": cpf})["hashedPassword"] == "hash"
+
+    asyncio.run(store.update(cpf, User(**dict(new_user, lastName="Changed"))))
+    assert not old.sync.docs
+    owner = collections[owner_index]
+    assert owner.sync.find_one({"cpf": cpf})["lastName"] == "Changed"
+
+    old.sync.insert_one(User(**new_user).dict())
+    asyncio.run(store.remove(cpf))
+    assert all(not c.sync.docs for c in collections)
+
+
+def test_rebalance_after_adding_partition():
+    old_store, old_collections = partitioned_store(3)
+    add_all(old_store, people)
+    collections = [c.sync for c in old_collections] + [InMemoryCollection()]
+
+    dry_run_moves = rebalance(collections, dry_run=True)
+    assert not collections[3].docs
+    moves = rebalance(collections)
+    assert moves == dry_run_moves
+    assert set(target for _, target in moves) == {3}
+    assert sum(len(c.docs) for c in collections) == len(people)
+    for index, collection in enumerate(collections):
+        for doc in collection.docs:
+            assert partition_index(doc["cpf"], 4) == index
+    assert rebalance(collections) == {}
+
+
+def test_rebalance_keeps_copy_written_while_migrating():
+    cpf = new_user["cpf"]
+    owner_index = partition_index(cpf, 2)
+    collections = [InMemoryCollection(), InMemoryCollection()]
+    collections[1 - owner_index].insert_one(dict(new_user, lastName="Old"))
+    collections[owner_index].insert_one(dict(new_user, lastName="New"))
+
+    assert rebalance(collections) == {(1 - owner_index, owner_index): 1}
+    assert [d["lastName"] for d in collections[owner_index].docs] == ["New"]
+    assert not collections[1 - owner_index].docs
+
+
+def misplaced_user(partitions=2):
+    "Returns collections, and the index of the one with a user it does not own."
+    collections = [InMemoryCollection() for _ in range(partitions)]
+    source_index = (partition_index(new_user["cpf"], partitions) + 1) % partitions
+    collections[source_index].insert_one(User(**new_user).dict())
+    return collections, source_index
+
+
+def test_rebalance_skips_user_removed_meanwhile():
+    collections, source_index = misplaced_user()
+    source = collections[source_index]
+    find = source.find
+
+    def find_then_remove(*args):
+        found = find(*args)
+        source.delete_many({"cpf": new_user["cpf"]})  # as the API would
+        return found
+
+    source.find = find_then_remove
+    assert rebalance(collections) == {}
+    assert all(not c.docs for c in collections)
+    assert all(c.unique_keys == {"cpf"} for c in collections)
+
+
+def test_rebalance_keeps_user_updated_meanwhile():
+    collections, source_index = misplaced_user()
+    source, target = collections[source_index], collections[1 - source_index]
+    update_one = target.update_one
+
+    def copy_then_update(*args, **kwargs):
+        copied = update_one(*args, **kwargs)
+        # as the API would while migrating: write the owner, drop other copies
+        target.replace_one({"cpf": new_user["cpf"]}, dict(new_user, lastName="New"))
+        source.delete_many({"cpf": new_user["cpf"]})
+        return copied
+
+    target.update_one = copy_then_update
+    assert rebalance(collections) == {}
+    assert [d["lastName"] for d in target.docs] == ["New"]
+    assert not source.docs
+
+
+def test_rebalance_interrupted_loses_no_user():
+    collections, source_index = misplaced_user()
+    source, target = collections[source_index], collections[1 - source_index]
+
+    def interrupt(*args, **kwargs):
+        raise KeyboardInterrupt
+
+    target.update_one = interrupt
+    with raises(KeyboardInterrupt):
+        rebalance(collections)
+    assert source.find_one({"cpf": new_user["cpf"]})
+
+    del target.update_one
+    assert rebalance(collections) == {(source_index, 1 - source_index): 1}
+    assert target.find_one({"cpf": new_user["cpf"]}) and not source.docs